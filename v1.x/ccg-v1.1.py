@@ -20,6 +20,7 @@ variables = {}      # Variables database used to store variables and variable va
 errors = {}         # Errors database used to store all errors generated
 devices = []        # Only used right at the end to determine which config files were generated
 positions = {}      # Store column heading and positions of spreadsheet file
+workbook = None     # The build spreadsheet, opened once by main() and shared by every function
 
 global filename     # The filename used to open the build spreadsheet
 
@@ -41,7 +42,7 @@ class Logger(object):
 # This function will read the worksheet and determine the position of each column
 #-----------------------------------------------------------------------------------
 def locatePos():
-    book = xlrd.open_workbook(filename)
+    book = workbook
     global positions
 
     #--------------------------------------------------
@@ -64,6 +65,19 @@ def locatePos():
             column_name = worksheet.col(x)[0].value
             positions[sheet][column_name] = x
             #print ("Worksheet: {0} and column name is {1}".format(sheet,column_name))
+        #--------------------------------------------------------------------
+        # Only the header was needed, the Read* functions load it again later
+        #--------------------------------------------------------------------
+        UnloadSheet(sheet)
+
+#----------------------------------------------------------------------------
+# Free a worksheet once it has been read. xlrd only loads .xls worksheets on
+# demand, .xlsx files are loaded in full (and can't load a sheet again), so
+# those are kept until release_resources() is called
+#----------------------------------------------------------------------------
+def UnloadSheet(sheet_name):
+    if workbook.on_demand:
+        workbook.unload_sheet(sheet_name)
 
 #----------------------------------------------------------
 # Retrieve the column position based on the column name
@@ -75,6 +89,21 @@ def GetPos(worksheet,column_name):
         print ("ERROR: cannot read %s [%s]"%(worksheet,column_name))
         return -1
 
+#-------------------------------------------------------------------------------
+# Check the address is a usable host in its subnet without walking iter_hosts()
+# (/31 and /32 have no network or broadcast address, IPv6 only reserves the
+# first address unless it's a /127 or /128)
+#-------------------------------------------------------------------------------
+def IsHostAddress(addr):
+    address = int(addr.ip)
+    if addr.version == 4:
+        if addr.prefixlen >= 31:
+            return True
+        return addr.first < address < addr.last
+    if addr.prefixlen >= 127:
+        return True
+    return address != addr.first
+
 #-------------------------------------------------
 # Capture log and store it in the error database
 #-------------------------------------------------
@@ -457,7 +486,6 @@ class ReadConfig(object):
 
         workbook_name = filename
         worksheet_name = "variables"
-        workbook = xlrd.open_workbook(workbook_name)
         worksheet = workbook.sheet_by_name(worksheet_name)
         print ("-----------------------------------------------------------------")
         print ("Reading '%s' from %s (empty variables ignored)" % (worksheet_name,workbook_name))
@@ -495,6 +523,7 @@ class ReadConfig(object):
             #------------------------------------------------------------------------
             print ("%s variable added to database" % variable)
             variables[variable] = variable_value
+        UnloadSheet(worksheet_name)
 
     #-----------------------------------------------------
     # Read the vlan worksheet and capture all the values
@@ -503,7 +532,6 @@ class ReadConfig(object):
 
         workbook_name = filename
         worksheet_name = "vlans"
-        workbook = xlrd.open_workbook(workbook_name)
         worksheet = workbook.sheet_by_name(worksheet_name)
         print ("------------------------------------")
         print ("Reading '%s' from %s " % (worksheet_name,workbook_name))
@@ -563,6 +591,7 @@ class ReadConfig(object):
             if vlan and vlan_name:
                 print ("%s will create VLAN [%s]"%(current_device,int(vlan)))
                 database[current_device]["Vlans"][vlan] = vlan_name
+        UnloadSheet(worksheet_name)
 
     #-----------------------------------------------------
     # Read the vrf worksheet and capture all the values
@@ -571,7 +600,6 @@ class ReadConfig(object):
 
         workbook_name = filename
         worksheet_name = "vrf"
-        workbook = xlrd.open_workbook(workbook_name)
         worksheet = workbook.sheet_by_name(worksheet_name)
         print ("---------------------------------")
         print ("Reading '%s' from %s" % (worksheet_name,workbook_name))
@@ -636,6 +664,7 @@ class ReadConfig(object):
                 self.UpdateVrf(current_device,vrf,"RTImport", import_rt)
             if export_rt:
                 self.UpdateVrf(current_device,vrf,"RTExport", export_rt)
+        UnloadSheet(worksheet_name)
 
     #-----------------------------------------------------
     # Read the routing worksheet and capture all the values
@@ -644,7 +673,6 @@ class ReadConfig(object):
 
         workbook_name = filename
         worksheet_name = "routing"
-        workbook = xlrd.open_workbook(workbook_name)
         worksheet = workbook.sheet_by_name(worksheet_name)
         print ("---------------------------------")
         print ("Reading '%s' from %s" % (worksheet_name,workbook_name))
@@ -707,6 +735,7 @@ class ReadConfig(object):
                 self.UpdateRoute(current_device,route,"NextHop", route_next_hop)
             if route_name:
                 self.UpdateRoute(current_device,route,"Name", route_name)
+        UnloadSheet(worksheet_name)
 
     #-----------------------------------------------------
     # Read the routing worksheet and capture all the values
@@ -715,7 +744,6 @@ class ReadConfig(object):
 
         workbook_name = filename
         worksheet_name = "prefix-list"
-        workbook = xlrd.open_workbook(workbook_name)
         worksheet = workbook.sheet_by_name(worksheet_name)
         print ("---------------------------------")
         print ("Reading '%s' from %s" % (worksheet_name,workbook_name))
@@ -803,6 +831,7 @@ class ReadConfig(object):
                 else:
                     CaptureError("PrefixList",current_device,"Duplicate prefix entry",prefix_name,"Not used")
                     continue
+        UnloadSheet(worksheet_name)
 
 
     #-------------------------------------------------------------------------
@@ -812,7 +841,6 @@ class ReadConfig(object):
 
         workbook_name = filename
         worksheet_name = "profiles"
-        workbook = xlrd.open_workbook(workbook_name)
         worksheet = workbook.sheet_by_name(worksheet_name)
         print ("---------------------------------")
         print ("Reading '%s' from %s" % (worksheet_name,workbook_name))
@@ -872,6 +900,7 @@ class ReadConfig(object):
             #------------------------------------------------------------------------
             else:
                 CaptureError("Profiles",current_device,"Invalid/blank profile used", profile,"Not used")
+        UnloadSheet(worksheet_name)
 
 
     #----------------------------------------------------------
@@ -881,7 +910,6 @@ class ReadConfig(object):
 
         workbook_name = filename
         worksheet_name = "portchannels"
-        workbook = xlrd.open_workbook(workbook_name)
         worksheet = workbook.sheet_by_name(worksheet_name)
         print ("-------------------------------------")
         print ("Reading '%s' from %s" % (worksheet_name,workbook_name))
@@ -1003,6 +1031,7 @@ class ReadConfig(object):
                         self.UpdateInterface(current_device,member_port,"PortChannelGroup", int(channel_group))
                         self.UpdateInterface(current_device,member_port,"PortChannelMode", channel_mode)
                         self.UpdateInterface(current_device,member_port,"PortEnabled", "Yes")
+        UnloadSheet(worksheet_name)
 
 
 
@@ -1013,7 +1042,6 @@ class ReadConfig(object):
 
         workbook_name = filename
         worksheet_name = "layer2"
-        workbook = xlrd.open_workbook(workbook_name)
         worksheet = workbook.sheet_by_name(worksheet_name)
         print ("-------------------------------------")
         print ("Reading '%s' from %s" % (worksheet_name,workbook_name))
@@ -1120,6 +1148,7 @@ class ReadConfig(object):
                     CaptureError("Layer2",current_device,"Description already defined",interface+":"+description,"Ignored")
                 else:
                     self.UpdateInterface(current_device,interface,"Description", description)
+        UnloadSheet(worksheet_name)
 
 
     #--------------------------------------------------------------
@@ -1129,7 +1158,6 @@ class ReadConfig(object):
 
         workbook_name = filename
         worksheet_name = "layer3"
-        workbook = xlrd.open_workbook(workbook_name)
         worksheet = workbook.sheet_by_name(worksheet_name)
         print ("-------------------------------------")
         print ("Reading '%s' from %s" % (worksheet_name,workbook_name))
@@ -1219,6 +1247,7 @@ class ReadConfig(object):
                     CaptureError("Layer3",current_device,"Description already defined",interface+":"+description,"Ignored")
                 else:
                     self.UpdateInterface(current_device,interface,"Description", description)
+        UnloadSheet(worksheet_name)
 
     #------------------------------------------------------
     # Check to see if the interface is logical or physical
@@ -1421,7 +1450,7 @@ class GenerateConfig(object):
                     addr = IPNetwork(ip_address)
                     ip,mask = ip_address.split("/")
 
-                    if IPAddress(ip) in IPNetwork(ip_address).iter_hosts():
+                    if IsHostAddress(addr):
                         database[device_name]["Interface"][interface_name]["IpAddress"] = str(addr.ip)
                         database[device_name]["Interface"][interface_name]["SubnetMask"] = str(addr.netmask)
                     #-------------------------------------------------------------------------------------
@@ -2044,10 +2073,15 @@ def main(argv):
 
     if sys.argv[1]:
         global filename
+        global workbook
         filename = sys.argv[1]
     try:
-        workbook = xlrd.open_workbook(filename)
+        #-------------------------------------------------------------------------
+        # Open the build spreadsheet once, worksheets are only loaded when used
+        #-------------------------------------------------------------------------
+        workbook = xlrd.open_workbook(filename, on_demand=True)
         ShowMenu()
+        workbook.release_resources()
     except IOError:
         print ("Unable to open: %s"% sys.argv[1])
         print ("Program aborted.")
@@ -0,0 +1,135 @@
+import os
+import sys
+import time
+import timeit
+import tempfile
+import tracemalloc
+from netaddr import *
+from ccg_support import LoadCcg, WriteWorkbook
+
+__author__ = 'Abdul Karim El-Assaad'
+
+#-----------------------------------------------------------------------
+# Micro benchmarks for the Cisco Config Generator
+# Usage: ccg-bench.py [workbook.xlsx]
+#   Without a workbook a generated 100k row interfaces sheet is used
+#-----------------------------------------------------------------------
+
+#--------------------------------------------------------------------------
+# Time one call of func(arg) in microseconds (best of a few short rounds)
+#--------------------------------------------------------------------------
+def TimeCall(func, arg, number):
+    timer = timeit.Timer(lambda: func(arg))
+    return min(timer.repeat(repeat=3, number=number)) / number * 1000000
+
+#-----------------------------------------------------------------------------
+# Interface IP validation: is_host_address() against the old iter_hosts() walk
+# The last host in the subnet is used as that's the worst case for the walk,
+# which is only timed up to /16 (a /8 takes around 30 seconds per address)
+#-----------------------------------------------------------------------------
+def BenchIpValidation(ccg):
+    def old_check(ip_network):
+        return IPAddress(ip_network.ip) in ip_network.iter_hosts()
+
+    print ("============================================================")
+    print ("Interface IP validation (usec per call)")
+    print ("============================================================")
+    print ("{:>8} {:>18} {:>18}".format("prefix", "is_host_address", "iter_hosts"))
+    for prefix in (1, 8, 16, 20, 24, 28, 30, 31, 32):
+        subnet = IPNetwork("10.0.0.0/{}".format(prefix))
+        last_host = IPAddress(subnet.last - 1 if prefix < 31 else subnet.last)
+        ip_network = IPNetwork("{}/{}".format(last_host, prefix))
+        new_time = TimeCall(ccg.is_host_address, ip_network, 20000)
+        if prefix >= 16:
+            old_time = "{:.2f}".format(TimeCall(old_check, ip_network, 1))
+        else:
+            old_time = "skipped"
+        print ("{:>8} {:>18.2f} {:>18}".format("/{}".format(prefix), new_time, old_time))
+
+#-------------------------------------------------------------------------
+# Write a minimal .xlsx with a single "interfaces" sheet of num_rows rows
+#-------------------------------------------------------------------------
+def WriteTestWorkbook(filename, num_rows):
+    rows = [["Device Name", "Interface", "Interface Enabled (yes/no)", "Description",
+             "IP Address (x.x.x.x/x)", "Data VLAN", "Trunk Allowed VLANs (separated by commas)"]]
+    for row_no in range(2, num_rows + 2):
+        device = "Switch-{}".format(row_no // 48)
+        port = "Gi1/0/{}".format(row_no % 48 + 1)
+        rows.append([device, port, "yes", "** Workstation Port **",
+                     "10.{}.{}.1/24".format(row_no // 256 % 256, row_no % 256), 2000.0, "1-4094"])
+    WriteWorkbook(filename, {"interfaces": rows}, shared_strings=False)
+
+#------------------------------------------------------------------------------
+# Workbook ingestion: time and peak memory to read every row of every sheet
+# with each reader backend (xlrd 2.x can't read .xlsx, so it may be skipped)
+#------------------------------------------------------------------------------
+def BenchIngestion(ccg, filename):
+    def read_all(reader_class):
+        workbook = reader_class(filename)
+        num_rows = 0
+        for sheet_name in workbook.GetSheetNames():
+            for row in workbook.IterRows(sheet_name):
+                num_rows += 1
+        return num_rows
+
+    print ("============================================================")
+    print ("Workbook ingestion: {} ({:.1f} MB)".format(os.path.basename(filename), os.path.getsize(filename) / 1048576.0))
+    print ("============================================================")
+    print ("{:>18} {:>10} {:>12} {:>14}".format("reader", "rows", "seconds", "peak MB"))
+    for reader_class in (ccg.XlsxStreamReader, ccg.XlrdReader):
+        tracemalloc.start()
+        start = time.time()
+        try:
+            num_rows = read_all(reader_class)
+        except Exception as error:
+            tracemalloc.stop()
+            print ("{:>18} skipped ({})".format(reader_class.__name__, error))
+            continue
+        elapsed = time.time() - start
+        peak = tracemalloc.get_traced_memory()[1] / 1048576.0
+        tracemalloc.stop()
+        print ("{:>18} {:>10} {:>12.2f} {:>14.1f}".format(reader_class.__name__, num_rows, elapsed, peak))
+
+#-----------------------------------------------------------------------------
+# Config template expansion: GetConfigTemplateList() over a template library of
+# num_lines lines (a third of them with variables, some of which don't exist)
+#-----------------------------------------------------------------------------
+def BenchTemplateExpansion(ccg, num_lines=50000):
+    column = "Enter config templates below this line:"
+    columns = {column: 0, "Row": 1}
+    rows = []
+    for line_no in range(num_lines):
+        if line_no % 100 == 0:
+            line = "Config Template: [TEMPLATE-{}]".format(line_no // 100)
+        elif line_no % 3:
+            line = "interface GigabitEthernet1/0/{}".format(line_no % 48 + 1)
+        else:
+            line = "  description [SITE-NAME] uplink to [CORE-{}]".format(line_no % 8)
+        rows.append(ccg.RowRecord(columns, (line, line_no + 2)))
+    db = ccg.Config(None)
+    db.raw_db["config-templates"] = rows
+    db.error_db["config-templates"] = []
+    db.variable_list = {"SITE-NAME": "SYD01"}
+    db.variable_list.update(("CORE-{}".format(core), "CoreSwitch-{}".format(core)) for core in range(4))
+
+    print ("============================================================")
+    print ("Config template expansion ({} lines)".format(num_lines))
+    print ("============================================================")
+    start = time.time()
+    db.GetConfigTemplateList()
+    print ("{:>18} {:>12.1f} ms".format("GetConfigTemplateList", (time.time() - start) * 1000))
+
+def main(argv):
+    ccg = LoadCcg()
+    BenchIpValidation(ccg)
+    BenchTemplateExpansion(ccg)
+    if len(argv) > 1:
+        BenchIngestion(ccg, argv[1])
+    else:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, "ccg-bench.xlsx")
+            WriteTestWorkbook(filename, 100000)
+            BenchIngestion(ccg, filename)
+
+if __name__ == '__main__':
+    main(sys.argv)
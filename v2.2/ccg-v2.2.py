@@ -1,253 +1,1044 @@
-import xlrd
+import io
+import os
 import re
 import sys
-from netaddr import *
+import json
+import pickle
+import hashlib
+import tempfile
+import heapq
+import bisect
+import itertools
+import zipfile
+import multiprocessing
 from operator import itemgetter
+from collections import OrderedDict
+from xml.etree import ElementTree
+from netaddr import *
+try:
+    import xlrd     # Only needed for .xls workbooks
+except ImportError:
+    xlrd = None
 
 __author__ = 'Abdul Karim El-Assaad'
 __version__ = '(CCG) Version: 2.2 (12/11/2014)'  # Cisco Config Generator version
 
-error_db = {}
-
-raw_db = {}             # Stores all the raw data from the build spreadsheet
-device_list = []        # Stores the valid device list from raw_db
-worksheet_list = []     # Stores the names of all worksheets in the build spreadsheet
-column_list = {}
-
-# Create a unique global dictionary for each worksheet
-config_templates = {}   # Stores the config templates from raw_db
-variable_list = {}      # Stores the valid variables from raw_db
-profile_list = {}       # Stores the profiles from raw_db
-vlan_list = {}          # Stores the valid vlans from raw_db
-vrf_list = {}           # Stores the valid vrfs from raw_db
-interface_list = {}        # Stores the layer2 information from raw_db
-static_route_list = {}  # Stores the routing information from raw_db
-prefix_list = {}        # Stores the prefix-list information from raw_db
-portchannel_list = {}   # Stores the port-channel list information from raw_db
-
-global filename
-
 '''
 =============================================================================
 How to add a new worksheet:
-    * Create a new global dictionary or list (see above)
+    * Create a new dictionary or list in Config.__init__()
     * Update RemoveEmptyRowsFromDB() function to include the new required columns
-    * Create a function called Get<whatever>List
-    * Create a function called Create<whatever>Configuration
+    * Create a function called Get<whatever>List (use GetDeviceRows() to
+      read the rows for each device in device_list)
+    * Create a function called Create<whatever>Config (add the config lines
+      with output.AddLine()) and call it from CreateDeviceConfig()
 =============================================================================
 '''
 
-#-----------------------------------------
-# Used to redirect output to a text file
-#-----------------------------------------
-class Logger(object):
-    def __init__(self, filename="Default.log"):
-        self.terminal = sys.stdout
-        self.log = open(filename, "w")
-    def write(self, message):
-        #self.terminal.write(message)   # Shows output to screen
-        self.log.write(message)         # Writes output to file
+#------------------------------------------------------------------------
+# Collects the lines of an output file (device config, error report, etc)
+# in memory so the whole file can be written and closed in one go
+#------------------------------------------------------------------------
+class OutputBuffer(object):
+    def __init__(self):
+        self.lines = []
+
+    def AddLine(self, line=""):
+        self.lines.append(str(line))
+
+    # block is several lines already joined with "\n" (no "\n" at the end),
+    # which is added as is so the same string can be shared between buffers
+    def AddBlock(self, block):
+        self.lines.append(block)
+
+    def GetText(self):
+        if not self.lines:
+            return ""
+        return "\n".join(self.lines) + "\n"
+
+    def WriteFile(self, filename):
+        with open(filename, "w") as output_file:
+            output_file.write(self.GetText())
+
+#------------------------------------------------------------------------------
+# Workbook readers. Config only needs the worksheet names and the rows of each
+# worksheet as lists of cell values, so each backend provides:
+#   GetSheetNames()       - worksheet names in workbook order
+#   IterRows(sheet_name)  - yields each row (header first) as a list of values
+#   Close()               - release the file once everything has been read
+#   source                - the filename (or bytes/file object) it was opened with
+#   trimmed_rows          - {sheet_name: number of empty rows dropped from the
+#                           end of the sheet}, set once IterRows() has finished
+# Numbers are returned as floats (same as xlrd), empty cells as ''.
+# Worksheets are only loaded when IterRows() is called for them, so sheets
+# that are never asked for (i.e. "Instructions") are never decoded.
+# Use OpenWorkbook() to pick the backend based on the file type.
+#------------------------------------------------------------------------------
+class XlrdReader(object):
+    def __init__(self, filename):
+        if xlrd is None:
+            raise IOError("xlrd is required to read '{}'".format(filename))
+        self.source = filename
+        self.trimmed_rows = {}
+        if hasattr(filename, "read"):
+            self.workbook = xlrd.open_workbook(file_contents=filename.read(), on_demand=True)
+        else:
+            self.workbook = xlrd.open_workbook(filename, on_demand=True)
+
+    def GetSheetNames(self):
+        return self.workbook.sheet_names()
+
+    # Sheets that have been formatted to the bottom report every formatted row in
+    # nrows, so stop at the last row that actually has a value in it
+    def IterRows(self, sheet_name):
+        worksheet = self.workbook.sheet_by_name(sheet_name)
+        num_rows = worksheet.nrows
+        while num_rows and self.is_empty_row(worksheet.row_values(num_rows - 1)):
+            num_rows -= 1
+        self.trimmed_rows[sheet_name] = worksheet.nrows - num_rows
+        for row_no in range(num_rows):
+            yield worksheet.row_values(row_no)
+        # xlrd loads .xlsx files in full (on_demand is ignored) and can't load an
+        # unloaded sheet again, so only .xls sheets are unloaded
+        if self.workbook.on_demand:
+            self.workbook.unload_sheet(sheet_name)
+
+    def is_empty_row(self, values):
+        return values.count("") == len(values)
+
+    def Close(self):
+        self.workbook.release_resources()
+
+#------------------------------------------------------------------------------
+# Reads .xlsx/.xlsm files straight from the sheet XML inside the zip file.
+# Rows are parsed one at a time and thrown away once they've been yielded, so
+# the full cell grid is never built in memory (only the shared strings are).
+#------------------------------------------------------------------------------
+class XlsxStreamReader(object):
+    MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+    REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+    PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+    XML_SPACE = "{http://www.w3.org/XML/1998/namespace}space"
+    ESCAPED_CHAR = re.compile(r"_x([0-9A-Fa-f]{4})_")
+
+    def __init__(self, filename):
+        try:
+            self.archive = zipfile.ZipFile(filename)
+        except zipfile.BadZipfile:
+            raise IOError("'{}' is not a valid .xlsx file".format(filename))
+        self.source = filename
+        self.trimmed_rows = {}
+        self.sheet_paths = self.ReadSheetPaths()
+        self.shared_strings = None  # Read by IterRows() when a sheet is first read
+
+    # Map each worksheet name to the XML file that holds it (via the workbook rels)
+    def ReadSheetPaths(self):
+        targets = {}
+        rels = ElementTree.fromstring(self.archive.read("xl/_rels/workbook.xml.rels"))
+        for rel in rels.iter(self.PKG_REL_NS + "Relationship"):
+            target = rel.get("Target")
+            if target.startswith("/"):
+                target = target[1:]
+            else:
+                target = "xl/" + target
+            targets[rel.get("Id")] = target
+        sheet_paths = OrderedDict()
+        workbook = ElementTree.fromstring(self.archive.read("xl/workbook.xml"))
+        for sheet in workbook.iter(self.MAIN_NS + "sheet"):
+            sheet_paths[sheet.get("name")] = targets[sheet.get(self.REL_NS + "id")]
+        return sheet_paths
+
+    def ReadSharedStrings(self):
+        shared_strings = []
+        if "xl/sharedStrings.xml" not in self.archive.namelist():
+            return shared_strings
+        with self.archive.open("xl/sharedStrings.xml") as xml_file:
+            for event, element in ElementTree.iterparse(xml_file):
+                if element.tag == self.MAIN_NS + "si":
+                    shared_strings.append(self.GetText(element))
+                    element.clear()
+        return shared_strings
+
+    # Join all the text runs in a string item, ignoring phonetic (rPh) runs
+    def GetText(self, element):
+        text = []
+        for child in element:
+            if child.tag == self.MAIN_NS + "t":
+                text.append(self.GetTextNode(child))
+            elif child.tag == self.MAIN_NS + "r":
+                for run in child.iter(self.MAIN_NS + "t"):
+                    text.append(self.GetTextNode(run))
+        return "".join(text)
+
+    # Whitespace is only kept if marked as preserved, and _xHHHH_ escapes are
+    # converted back to the character (same as xlrd)
+    def GetTextNode(self, node):
+        text = node.text or ""
+        if node.get(self.XML_SPACE) != "preserve":
+            text = text.strip("\t\n\r ")
+        if "_x" in text:
+            text = self.ESCAPED_CHAR.sub(lambda match: chr(int(match.group(1), 16)), text)
+        return text
+
+    # Convert a cell reference such as "AB12" into a column number (starting at 0)
+    def GetColumn(self, reference):
+        column = 0
+        for letter in reference:
+            if letter.isdigit():
+                break
+            column = column * 26 + ord(letter.upper()) - 64
+        return column - 1
+
+    def GetCellValue(self, cell):
+        cell_type = cell.get("t", "n")
+        if cell_type == "inlineStr":
+            inline = cell.find(self.MAIN_NS + "is")
+            return self.GetText(inline) if inline is not None else ""
+        value = cell.findtext(self.MAIN_NS + "v")
+        if value is None:
+            return ""
+        if cell_type == "s":
+            return self.shared_strings[int(value)]
+        if cell_type == "b":
+            return int(value)
+        if cell_type in ("str", "e"):
+            return value
+        return float(value)
+
+    def GetSheetNames(self):
+        return list(self.sheet_paths)
+
+    def Close(self):
+        self.archive.close()
+
+    # Rows that have no values (only formatting) are held back until a row with
+    # values turns up, so trailing empty rows are dropped the same way xlrd does.
+    # xlrd never stores a cell that only has formatting, so only the rows after
+    # the last row with values that have a stored cell are counted as trimmed
+    def IterRows(self, sheet_name):
+        if self.shared_strings is None:
+            self.shared_strings = self.ReadSharedStrings()
+        next_row = 1
+        empty_rows = 0
+        last_row = 0
+        last_stored_row = 0
+        sheet_data = None
+        with self.archive.open(self.sheet_paths[sheet_name]) as xml_file:
+            for event, element in ElementTree.iterparse(xml_file, events=("start", "end")):
+                if event == "start":
+                    if element.tag == self.MAIN_NS + "sheetData":
+                        sheet_data = element
+                    continue
+                if element.tag != self.MAIN_NS + "row":
+                    continue
+                row_no = int(element.get("r", next_row))
+                # Rows without any cells aren't stored in the file
+                empty_rows += row_no - next_row
+                next_row = row_no + 1
+                row = []
+                for cell in element.iter(self.MAIN_NS + "c"):
+                    column = self.GetColumn(cell.get("r")) if cell.get("r") else len(row)
+                    if column > len(row):
+                        row.extend([""] * (column - len(row)))
+                    row.append(self.GetCellValue(cell))
+                # Drop formatted cells with no value from the end of the row
+                while row and row[-1] == "":
+                    row.pop()
+                if row:
+                    for empty_row in range(empty_rows):
+                        yield []
+                    empty_rows = 0
+                    last_row = last_stored_row = row_no
+                    yield row
+                else:
+                    empty_rows += 1
+                    if any(self.is_stored_cell(cell) for cell in element.iter(self.MAIN_NS + "c")):
+                        last_stored_row = row_no
+                # Throw away the rows that have already been processed
+                sheet_data.clear()
+        self.trimmed_rows[sheet_name] = last_stored_row - last_row
+
+    # Same as xlrd: a cell with a value, even if it's an empty shared string
+    def is_stored_cell(self, cell):
+        return bool(cell.findtext(self.MAIN_NS + "v")) or cell.get("t") in ("str", "b", "e")
+
+#------------------------------------------------------------------------------
+# One row of a worksheet in raw_db. The cell values are kept in a tuple and the
+# column names are looked up in a {column name: position} map that is shared by
+# every row of the worksheet, rather than each row being its own dictionary.
+# Rows can be read the same way as a dictionary, i.e. row["Device Name"]
+#------------------------------------------------------------------------------
+class RowRecord(object):
+    __slots__ = ("columns", "values")
+
+    def __init__(self, columns, values):
+        self.columns = columns
+        self.values = values
+
+    def __getitem__(self, column):
+        return self.values[self.columns[column]]
+
+    def get(self, column, default=None):
+        position = self.columns.get(column)
+        if position is None:
+            return default
+        return self.values[position]
+
+    def items(self):
+        values = self.values
+        return [(column, values[position]) for column, position in self.columns.items()]
+
+#------------------------------------------------------------------------------
+# Open the build spreadsheet with the right reader. filename can also be the
+# contents of the workbook (bytes) or a file-like object, in which case the
+# type is worked out from the data (.xlsx files are zip files, .xls are not)
+#------------------------------------------------------------------------------
+def OpenWorkbook(filename):
+    if isinstance(filename, bytes):
+        filename = io.BytesIO(filename)
+    if hasattr(filename, "read"):
+        if zipfile.is_zipfile(filename):
+            filename.seek(0)
+            return XlsxStreamReader(filename)
+        filename.seek(0)
+        return XlrdReader(filename)
+    if filename.lower().endswith((".xlsx", ".xlsm")):
+        return XlsxStreamReader(filename)
+    return XlrdReader(filename)
+
+#------------------------------------------------------------------------------
+# Check whether the address part of x.x.x.x/y is a usable host in its subnet.
+# Same result as "IPAddress(ip) in IPNetwork(ip).iter_hosts()" but worked out
+# from the network boundaries, so a /8 costs the same as a /30:
+#   * IPv4 /31 and /32 (and IPv6 /127 and /128) have no reserved addresses
+#   * IPv4 excludes the network and broadcast addresses
+#   * IPv6 only excludes the subnet-router anycast (first) address
+#------------------------------------------------------------------------------
+def is_host_address(ip_network):
+    address = int(ip_network.ip)
+    if ip_network.version == 4:
+        if ip_network.prefixlen >= 31:
+            return True
+        return ip_network.first < address < ip_network.last
+    if ip_network.prefixlen >= 127:
+        return True
+    return address != ip_network.first
+
+#------------------------------------------------------------------------------
+# Entries of a single prefix-list, kept in sequence number order as they are
+# added so they never need sorting. The first entry for a sequence number wins.
+#------------------------------------------------------------------------------
+class PrefixList(object):
+    def __init__(self):
+        self.sequences = []     # Sorted list of the sequence numbers
+        self.entries = {}       # Stores each entry by sequence number
+
+    def AddEntry(self, sequence, action, entry):
+        if sequence in self.entries:
+            return False
+        self.entries[sequence] = {"sequence":sequence,"action":action,"entry":entry}
+        # Rows are usually in order already, so appending is the common case
+        if not self.sequences or self.sequences[-1] < sequence:
+            self.sequences.append(sequence)
+        else:
+            bisect.insort(self.sequences, sequence)
+        return True
+
+    def GetEntry(self, sequence):
+        return self.entries.get(sequence)
+
+    def __iter__(self):
+        for sequence in self.sequences:
+            yield self.entries[sequence]
+
+    def __len__(self):
+        return len(self.sequences)
+
+#------------------------------------------------------------------------------
+# A set of VLANs stored as sorted, non-overlapping (start, end) ranges, e.g.
+# "1-10, 20,21" is stored as [(1, 10), (20, 21)]. Used for trunk allowed VLANs
+# so "1-4094" is one range instead of 4094 separate VLANs.
+#------------------------------------------------------------------------------
+class VlanRanges(object):
+    def __init__(self, ranges=()):
+        merged = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1] + 1:
+                if end > merged[-1][1]:
+                    merged[-1][1] = end
+            else:
+                merged.append([start, end])
+        self.ranges = [(start, end) for start, end in merged]
+
+    # Raises ValueError if the text isn't a valid list of VLANs and ranges
+    @classmethod
+    def FromString(cls, text):
+        ranges = []
+        for entry in str(text).replace(" ","").split(","):
+            if not entry:
+                continue
+            if "-" in entry:
+                start, end = entry.split("-")
+                start, end = int(start), int(end)
+                if start > end:
+                    raise ValueError("invalid vlan range '{}'".format(entry))
+            else:
+                start = end = int(entry)
+            ranges.append((start, end))
+        return cls(ranges)
+
+    def __iter__(self):
+        return iter(self.ranges)
+
+    def __len__(self):
+        return len(self.ranges)
+
+    # Same format IOS uses, i.e. "1-10,20,21"
+    def __str__(self):
+        vlans = []
+        for start, end in self.ranges:
+            if start == end:
+                vlans.append(str(start))
+            elif start + 1 == end:
+                vlans.append("{},{}".format(start, end))
+            else:
+                vlans.append("{}-{}".format(start, end))
+        return ",".join(vlans)
+
+#------------------------------------------------------------------------------
+# The VLANs configured on a device stored as a 4096 bit bitmap (bit n set means
+# VLAN n exists), so checking a VLAN or a whole trunk is a couple of integer
+# operations rather than a dictionary lookup per VLAN.
+#------------------------------------------------------------------------------
+class VlanBitmap(object):
+    MAX_VLAN = 4095
+
+    def __init__(self, vlans=()):
+        self.bits = 0
+        for vlan in vlans:
+            self.AddVlan(vlan)
+
+    def AddVlan(self, vlan):
+        if 0 <= vlan <= self.MAX_VLAN:
+            self.bits |= 1 << vlan
+
+    def GetRangeMask(self, start, end):
+        return ((1 << (end - start + 1)) - 1) << start
+
+    # True if every VLAN in vlan_ranges (a VlanRanges) is set in the bitmap.
+    # A range outside 0-MAX_VLAN can't be covered, and is checked before the
+    # mask is built so a typo like "1-4094000000" doesn't build a huge number
+    def Covers(self, vlan_ranges):
+        mask = 0
+        for start, end in vlan_ranges:
+            if start < 0 or end > self.MAX_VLAN:
+                return False
+            mask |= self.GetRangeMask(start, end)
+        return not mask & ~self.bits
+
+    def __contains__(self, vlan):
+        if not 0 <= vlan <= self.MAX_VLAN:
+            return False
+        return bool(self.bits >> vlan & 1)
+
+#------------------------------------------------------------------------------
+# A config template compiled into the literal text and [variable] slots of
+# each line, e.g. "hostname [HOSTNAME]" is ["hostname ", ""] and ["HOSTNAME"],
+# so expanding it is a lookup per slot and a join rather than a regex and a
+# replace per variable. Render() gives the same lines as the old expansion:
+#   * a slot is replaced by the variable's value
+#   * if a line has at least one variable, the other brackets on the line are
+#     removed (unknown variables are left as the bare name)
+#   * if none of the variables on a line exist, the line is left as it is
+# A line that is only a [name] of another template (and not a variable) is
+# replaced by that template's lines, indented the same as the [name].
+#------------------------------------------------------------------------------
+class ConfigTemplate(object):
+    HEADER = re.compile(r'Config Template: \[(.*?)\]', re.IGNORECASE)
+    SLOT = re.compile(r'\[(.*?)\]')
+
+    def __init__(self, lines=()):
+        self.lines = []
+        for line in lines:
+            self.AddLine(line)
+
+    # SLOT.split() gives [literal, name, literal, name, ..., literal], which is
+    # kept as the first literal and (name, literal after it) for each slot
+    # split_lines is shared by templates that are likely to have the same
+    # lines, so each different line is only split once
+    def AddLine(self, line, split_lines=None):
+        if "[" not in line:
+            self.lines.append((line, None, ()))
+            return
+        if split_lines is not None and line in split_lines:
+            self.lines.append(split_lines[line])
+            return
+        parts = self.SLOT.split(line)
+        parts[0::2] = [literal.replace("[", "").replace("]", "") for literal in parts[0::2]]
+        split_line = (line, parts[0], tuple(zip(parts[1::2], parts[2::2])))
+        if split_lines is not None:
+            split_lines[line] = split_line
+        self.lines.append(split_line)
+
+    def GetNames(self):
+        return [name for line, first_literal, slots in self.lines for name, literal in slots]
+
+    # Names on a line of their own, i.e. where another template could go
+    def GetIncludes(self):
+        return [slots[0][0] for line, first_literal, slots in self.lines
+                if len(slots) == 1 and not first_literal.strip() and not slots[0][1].strip()]
+
+    # Returns the expanded lines and the names (in order) that get_value()
+    # (or get_template() for a line of its own) didn't have anything for.
+    # rendered_lines keeps the lines already expanded with the same get_value()
+    # (not the ones get_template() filled in), to be shared between templates
+    def Render(self, get_value, get_template=None, rendered_lines=None):
+        rendered = []
+        missing = []
+        if rendered_lines is None:
+            rendered_lines = {}
+        for line, first_literal, slots in self.lines:
+            if not slots:
+                rendered.append(line)
+                continue
+            if line in rendered_lines:
+                rendered_line, line_missing = rendered_lines[line]
+                rendered.append(rendered_line)
+                missing.extend(line_missing)
+                continue
+            parts = [first_literal]
+            line_missing = []
+            for name, literal in slots:
+                value = get_value(name)
+                if value:
+                    parts.append(str(value))
+                else:
+                    line_missing.append(name)
+                    parts.append(name.replace("[", "").replace("]", ""))
+                parts.append(literal)
+            if line_missing:
+                if get_template is not None and len(slots) == 1 and not first_literal.strip() and not slots[0][1].strip():
+                    template_lines = get_template(slots[0][0])
+                    if template_lines is not None:
+                        rendered.extend(first_literal + template_line for template_line in template_lines)
+                        continue
+                missing.extend(line_missing)
+                if len(line_missing) == len(slots):
+                    rendered_lines[line] = (line, line_missing)
+                    rendered.append(line)
+                    continue
+            rendered_line = "".join(parts)
+            rendered_lines[line] = (rendered_line, line_missing)
+            rendered.append(rendered_line)
+        return rendered, missing
+
+#------------------------------------------------------------------------------
+# Order the nodes of a dependency graph ({node: [nodes it references]}) so each
+# node comes after everything it references. References to nodes that aren't
+# in the graph are ignored. Returns the order, the loops found and the set of
+# nodes that are part of a loop. The nodes are grouped into strongly connected
+# components (Tarjan), so every node that can reach itself is in the set no
+# matter which node the search starts from. Each loop is one path around a
+# component, from its first node (in the order of references) back to itself.
+# Done with a stack rather than recursion so long chains don't hit the
+# recursion limit.
+#------------------------------------------------------------------------------
+def SortDependencies(references):
+    order = []
+    cycles = []
+    looped = set()
+    index = {}
+    low = {}
+    stack = []
+    on_stack = set()
+    for root in references:
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(references[root]))]
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in references:
+                    continue
+                if child not in index:
+                    index[child] = low[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(references[child])))
+                    break
+                if child in on_stack:
+                    low[node] = min(low[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] != index[node]:
+                    continue
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                order.extend(reversed(component))
+                if len(component) > 1 or node in references[node]:
+                    looped.update(component)
+                    cycles.append(FindCycle(references, set(component)))
+    return order, cycles, looped
+
+# Shortest path from the first node of a component back to itself
+def FindCycle(references, component):
+    start = next(node for node in references if node in component)
+    parents = {}
+    queue = [start]
+    for node in queue:
+        for child in references[node]:
+            if child == start:
+                path = [start, node]
+                while path[-1] != start:
+                    path.append(parents[path[-1]])
+                return path[::-1]
+            if child in component and child not in parents:
+                parents[child] = node
+                queue.append(child)
+
+#------------------------------------------------------------------------------
+# External sort (--spill) for a worksheet that isn't sorted by device name.
+# Entries are held in memory until max_entries have been added, then sorted
+# and written to a temporary file (a "run"). Iterating merges the runs (and
+# whatever is left in memory) back together in key order, so at most
+# max_entries are in memory plus one entry per run. The keys must be unique.
+# Every run is an open file, so whenever the last MAX_RUNS runs are the same
+# level (i.e. went through the same number of merges) they're merged into one
+# run of the next level. That keeps it to MAX_RUNS - 1 open runs per level
+# (two levels covers 4000 runs) and each entry is only rewritten once per
+# level. Before iterating, the last runs are merged until there are at most
+# MAX_RUNS left to merge.
+#------------------------------------------------------------------------------
+class SortedRuns(object):
+    MAX_RUNS = 64
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = []
+        self.run_files = []
+        self.run_levels = []
+
+    def AddEntry(self, key, value):
+        self.entries.append((key, value))
+        if len(self.entries) >= self.max_entries:
+            self.WriteRun()
+
+    def WriteRun(self):
+        self.entries.sort(key=itemgetter(0))
+        self.AddRun(self.entries, 0)
+        self.entries = []
+        while len(self.run_levels) >= self.MAX_RUNS and len(set(self.run_levels[-self.MAX_RUNS:])) == 1:
+            self.MergeRuns(self.MAX_RUNS)
+
+    def AddRun(self, entries, level):
+        run_file = tempfile.TemporaryFile()
+        for entry in entries:
+            pickle.dump(entry, run_file, pickle.HIGHEST_PROTOCOL)
+        run_file.seek(0)
+        self.run_files.append(run_file)
+        self.run_levels.append(level)
+
+    # Merge the last num_runs runs into one run
+    def MergeRuns(self, num_runs):
+        run_files = self.run_files[-num_runs:]
+        level = max(self.run_levels[-num_runs:]) + 1
+        del self.run_files[-num_runs:]
+        del self.run_levels[-num_runs:]
+        try:
+            self.AddRun(heapq.merge(*[self.ReadRun(run_file) for run_file in run_files], key=itemgetter(0)), level)
+        finally:
+            for run_file in run_files:
+                run_file.close()
+
+    def ReadRun(self, run_file):
+        while True:
+            try:
+                yield pickle.load(run_file)
+            except EOFError:
+                return
+
+    def Close(self):
+        for run_file in self.run_files:
+            run_file.close()
+        self.run_files = []
+        self.run_levels = []
+        self.entries = []
+
+    def __iter__(self):
+        self.entries.sort(key=itemgetter(0))
+        try:
+            while len(self.run_files) >= self.MAX_RUNS:
+                self.MergeRuns(min(self.MAX_RUNS, len(self.run_files) - self.MAX_RUNS + 2))
+            runs = [self.ReadRun(run_file) for run_file in self.run_files]
+            runs.append(iter(self.entries))
+            for entry in heapq.merge(*runs, key=itemgetter(0)):
+                yield entry
+        finally:
+            self.Close()
+
+#------------------------------------------------------------------------------
+# Cache (--cache DIR) of what is read from a workbook: raw_db and friends after
+# RemoveEmptyRowsFromDB (see Config.GetRawDbState). Each entry is pickled to
+# DIR/<key>.pickle, the key being a sha256 of the workbook's bytes and the
+# version, so a workbook that hasn't changed is never read again. Entries are
+# touched when they're used and once the directory is over max_size bytes the
+# least recently used ones are removed.
+# CACHE_VERSION needs to go up whenever the cached data changes format.
+#------------------------------------------------------------------------------
+class BuildCache(object):
+    CACHE_VERSION = 4
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def GetKey(self, workbook_file):
+        digest = hashlib.sha256("{} {}".format(__version__, self.CACHE_VERSION).encode())
+        if isinstance(workbook_file, bytes):
+            digest.update(workbook_file)
+        elif hasattr(workbook_file, "read"):
+            position = workbook_file.tell()
+            workbook_file.seek(0)
+            for block in iter(lambda: workbook_file.read(1048576), b""):
+                digest.update(block)
+            workbook_file.seek(position)
+        else:
+            with open(workbook_file, "rb") as input_file:
+                for block in iter(lambda: input_file.read(1048576), b""):
+                    digest.update(block)
+        return digest.hexdigest()
+
+    def GetPath(self, key):
+        return os.path.join(self.cache_dir, key + ".pickle")
+
+    def Load(self, key):
+        path = self.GetPath(key)
+        try:
+            with open(path, "rb") as cache_file:
+                state = pickle.load(cache_file)
+            os.utime(path, None)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return None
+        return state
+
+    # Written to a temporary file first so another run never reads half an entry
+    # A cache that can't be written to doesn't stop the build
+    def Save(self, key, state):
+        path = self.GetPath(key)
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            with open(temp_path, "wb") as cache_file:
+                pickle.dump(state, cache_file, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except (IOError, OSError, pickle.PicklingError):
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        self.Evict()
+
+    def Evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".pickle"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total_size = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size
 
 #-----------------------------------------
 # Main class which has all the functions
 #-----------------------------------------
 class Config(object):
-    def __init__(self):
-        self.CreateRawDb()
+    def __init__(self, workbook, stream=False):
+        self.workbook = workbook        # Opened once by main() using OpenWorkbook()
+
+        self.error_db = {}
+        self.raw_db = {}                # Stores all the raw data from the build spreadsheet
+        self.device_list = []           # Stores the valid device list from raw_db
+        self.device_db = {}             # Stores the raw_db rows grouped by device and worksheet
+        self.worksheet_list = []        # Stores the names of all worksheets in the build spreadsheet
+        self.column_list = {}           # Stores the column names of each worksheet (in order)
+        self.column_index = {}          # Stores the position of each column name for each worksheet
+        self.ingest_stats = {}          # Stores the number of rows read/skipped for each worksheet
+        self.ignored_rows = []          # Stores the rows removed from raw_db by RemoveEmptyRowsFromDB
+        self.required_columns = {}      # Stores the columns each worksheet must have a value in
+        self.required_positions = {}    # Stores the (position, column name) of each required column
+        self.unsorted_worksheets = []   # Stores the worksheets IterSortedDevices found weren't sorted
+
+        # Create a unique dictionary for each worksheet
+        self.config_templates = {}      # Stores the config templates from raw_db
+        self.variable_list = {}         # Stores the valid variables from raw_db
+        self.variable_values = {}       # Stores the variables from raw_db (not expanded) for each scope
+        self.variable_rows = {}         # Stores the row of each variable for each scope
+        self.variable_scopes = {}       # Stores the expanded variables/config templates for each scope
+        self.device_scopes = {}         # Stores the scope of each device (see GetDeviceScope)
+        self.template_sources = {}      # Stores each config template from raw_db as a ConfigTemplate
+        self.template_rows = {}         # Stores the row of each config template name
+        self.variable_users = {}        # Stores the global variables that use each name
+        self.template_users = {}        # Stores the config templates that use each name
+        self.variable_loops = set()     # Stores the global variables that are part of a loop
+        self.template_loops = set()     # Stores the config templates that are part of a loop
+        self.expansion_errors = set()   # Stores the variable/config template errors of the global lists
+        self.profile_blocks = {}        # Stores each profile rendered for CreateGlobalConfig (see GetProfileBlock)
+        self.profile_list = {}          # Stores the profiles from raw_db
+        self.vlan_list = {}             # Stores the valid vlans from raw_db
+        self.vlan_bitmaps = {}          # Stores the vlans in vlan_list as a VlanBitmap for each device
+        self.vrf_list = {}              # Stores the valid vrfs from raw_db
+        self.interface_list = {}        # Stores the layer2 information from raw_db
+        self.static_route_list = {}     # Stores the routing information from raw_db
+        self.prefix_list = {}           # Stores the prefix-list information from raw_db
+        self.portchannel_list = {}      # Stores the port-channel list information from raw_db
+
+        # workbook is None for --jobs workers (see InitRenderWorker). With stream
+        # the workbook is read one device at a time by IterSortedDevices()
+        if workbook is not None and not stream:
+            self.CreateRawDb()
 
     # ----------------------------------------------------------------------
     # Read the content of the build spreadsheet into the raw_db dictionary
     # To access call:  raw_db["worksheet_name"][row_number]["Column name"]
+    # Each row is a RowRecord (see above) rather than a dictionary
+    # Rows with a device name are also grouped in device_db (see below)
     # ----------------------------------------------------------------------
     def CreateRawDb(self):
-        wb = xlrd.open_workbook(filename)
-        global raw_db
-        global worksheet_list
-        global device_list
-        global column_list
-        global error_db
-
-        temp_db = []
+        wb = self.workbook
 
-        for i, worksheet in enumerate(wb.sheets()):
-            if worksheet.name == "Instructions":
+        for worksheet_name in wb.GetSheetNames():
+            if worksheet_name == "Instructions":
                 continue
-            header_cells = worksheet.row(0)
-            num_rows = worksheet.nrows - 1
-            curr_row = 0
-            header = [each.value for each in header_cells]
-            column_list[worksheet.name] = header
-            # Add a column that doesn't exist in the worksheet
-            header.append("Row")
-            #-------------------------------------------------------------------------------------
-            # Iterate over each row in each worksheet and store the info in the raw_db dictionary
-            #-------------------------------------------------------------------------------------
-            while curr_row < num_rows:
-                curr_row += 1
-                row = [int(each.value) if isinstance(each.value, float)
-                       else each.value
-                       for each in worksheet.row(curr_row)]
-                # Add the row number to each record
-                row.append(curr_row+1)
-                value_dict = dict(zip(header, row))
-                temp_db.append(value_dict)
-            else:
-                #print ("raw_db: added '{}'".format(worksheet.name))
-                raw_db[worksheet.name] = temp_db
-                #---------------------------------------------------------------------
-                # Grab all the unique device worksheet names in the build spreadsheet
-                #---------------------------------------------------------------------
-                worksheet_list.append(worksheet.name)
-                error_db[worksheet.name] = []
-
-                #------------------------------------------------------------------------
-                # Re-initalise the temp_db database so it's ready for the next worksheet
-                #------------------------------------------------------------------------
-                temp_db = []
+            rows = wb.IterRows(worksheet_name)
+            self.AddWorksheet(worksheet_name,next(rows, []))
+            has_device_column = "Device Name" in self.column_index[worksheet_name]
+            temp_db = []
+            for record in self.IterRecords(worksheet_name,rows):
+                temp_db.append(record)
+                if has_device_column:
+                    self.AddToDeviceDb(worksheet_name,record)
+            #print ("raw_db: added '{}'".format(worksheet_name))
+            self.raw_db[worksheet_name] = temp_db
+
+    #---------------------------------------------------------------------
+    # Grab the column names of a worksheet from its header row and add the
+    # worksheet to the unique worksheet names in the build spreadsheet
+    #---------------------------------------------------------------------
+    def AddWorksheet(self,worksheet_name,header):
+        header = list(header)
+        self.column_list[worksheet_name] = header
+        # Add a column that doesn't exist in the worksheet
+        header.append("Row")
+        columns = {}
+        for position, column in enumerate(header):
+            columns[column] = position
+        self.column_index[worksheet_name] = columns
+        self.worksheet_list.append(worksheet_name)
+        self.error_db[worksheet_name] = []
+
+    #-------------------------------------------------------------------------------------
+    # Iterate over each row in a worksheet (after the header) and yield it as a RowRecord
+    # Rows that don't have a value in any column are skipped (and counted)
+    #-------------------------------------------------------------------------------------
+    def IterRecords(self,worksheet_name,rows):
+        columns = self.column_index[worksheet_name]
+        num_columns = len(self.column_list[worksheet_name]) - 1
+        num_rows = 0
+        empty_rows = 0
+        for curr_row, cells in enumerate(rows, 1):
+            cells = cells[:num_columns]
+            if cells.count("") == len(cells):
+                empty_rows += 1
+                continue
+            row = [int(value) if isinstance(value, float)
+                   else value
+                   for value in cells]
+            # Pad out rows that are shorter than the header
+            row.extend([""] * (num_columns - len(row)))
+            # Add the row number to each record
+            row.append(curr_row+1)
+            num_rows += 1
+            yield RowRecord(columns, tuple(row))
+        # The readers drop the empty rows at the end of the sheet themselves
+        trimmed_rows = self.workbook.trimmed_rows.get(worksheet_name, 0)
+        self.ingest_stats[worksheet_name] = {"Rows": num_rows, "Empty Rows": empty_rows + trimmed_rows,
+                                             "Trimmed Rows": trimmed_rows}
 
 #-------------------------------------------------------------------------------------
-# Read through raw_db and start storing relevant information in their global database
+# Read through raw_db and start storing relevant information in their own database
 #-------------------------------------------------------------------------------------
 
+    # ------------------------------------------------------------------------
+    # Group the raw_db rows by device as the workbook is read, i.e.
+    # device_db["device_name"]["worksheet_name"] = [rows from raw_db]
+    # The rows are the same records as raw_db, they are removed from both
+    # if RemoveEmptyRowsFromDB ignores them. Devices commented out with "!"
+    # are never added.
+    # ------------------------------------------------------------------------
+    def GetDeviceName(self,row):
+        return self.CleanDeviceName(row.get("Device Name"))
+
+    def CleanDeviceName(self,device_name):
+        if not device_name:
+            return
+        device_name = str(device_name)
+        if "!" in device_name:
+            return
+        return device_name.strip()
+
+    def AddToDeviceDb(self,worksheet,row):
+        device_name = self.GetDeviceName(row)
+        if device_name is None:
+            return
+        if device_name not in self.device_db:
+            self.device_db[device_name] = {}
+        if worksheet not in self.device_db[device_name]:
+            self.device_db[device_name][worksheet] = []
+        self.device_db[device_name][worksheet].append(row)
+
+    def RemoveFromDeviceDb(self,worksheet,row):
+        device_name = self.GetDeviceName(row)
+        if device_name is None:
+            return
+        device_rows = self.device_db[device_name][worksheet]
+        for position, entry in enumerate(device_rows):
+            if entry is row:
+                del device_rows[position]
+                break
+        if not device_rows:
+            del self.device_db[device_name][worksheet]
+        if not self.device_db[device_name]:
+            del self.device_db[device_name]
+
+    def GetDeviceRows(self,device_name,worksheet):
+        if self.device_db.get(device_name):
+            return self.device_db[device_name].get(worksheet,[])
+        return []
+
     #-----------------------------------------------------------------------
     # Create a database which contains a list devices from every worksheet
     #------------------------------------------------------------------------
     def GetDeviceList(self):
-        global device_list
-        raw_devices = []
-        for worksheet in worksheet_list:
-            for row,entry in enumerate(raw_db[worksheet]):
-                if raw_db[worksheet][row].get("Device Name"):
-                    if "!" in raw_db[worksheet][row].get("Device Name"):
-                        continue
-                    value = raw_db[worksheet][row].get("Device Name","none")
-                    value = value.strip()
-                    if value not in raw_devices:
-                        raw_devices.append(value)
-        device_list = sorted(raw_devices)
+        self.device_list = sorted(self.device_db)
 
 
     #-----------------------------------------------------------
     # Create a database that contains the VLANs for each device
     #-----------------------------------------------------------
     def GetVlanList(self):
-        global vlan_list
-        for row_no in range(len(raw_db["vlans"])):
-            device_name = raw_db["vlans"][row_no]["Device Name"]
-            if vlan_list.get(device_name):
-                continue
-            else:
-                vlan_list[device_name] = {}
-        for row_no in range(len(raw_db["vlans"])):
-            device_name = raw_db["vlans"][row_no]["Device Name"]
-            vlan_no = raw_db["vlans"][row_no]["VLAN No"]
-            vlan_name = raw_db["vlans"][row_no]["VLAN Name"]
-            vlan_list[device_name][vlan_no] = vlan_name
+        for device_name in self.device_list:
+            for row in self.GetDeviceRows(device_name,"vlans"):
+                if device_name not in self.vlan_list:
+                    self.vlan_list[device_name] = {}
+                vlan_no = row["VLAN No"]
+                vlan_name = row["VLAN Name"]
+                self.vlan_list[device_name][vlan_no] = vlan_name
+        for device_name in self.vlan_list:
+            vlans = [vlan for vlan in self.vlan_list[device_name] if isinstance(vlan, int)]
+            self.vlan_bitmaps[device_name] = VlanBitmap(vlans)
 
     #-----------------------------------------------------------
     # Create a database that contains the VRFs for each device
     #-----------------------------------------------------------
     def GetVrfList(self):
-        global vrf_list
-        for row_no in range(len(raw_db["vrf"])):
-            vrf_columns = {key: [] for key in column_list["vrf"]}
-            device_name = raw_db["vrf"][row_no]["Device Name"]
-            vrf = raw_db["vrf"][row_no]["VRF"]
-            if not vrf_list.get(device_name):
-                vrf_list[device_name] = {}
-            if not vrf_list[device_name].get(vrf):
-                vrf_list[device_name][vrf] = vrf_columns
-            for column in vrf_columns:
-                vrf_list[device_name][vrf][column] = raw_db["vrf"][row_no][column]
-            # If there are multiple route-targets grab them all
-            current_import = vrf_list[device_name][vrf]["Import RT  (separated by commas)"]
-            current_import = current_import.strip()
-            current_import = current_import.replace(" ","")
-            current_export = vrf_list[device_name][vrf]["Export RT  (separated by commas)"]
-            current_export = current_export.strip()
-            current_export = current_export.replace(" ","")
-            new_import = current_import.split(",")
-            new_export = current_export.split(",")
-            vrf_list[device_name][vrf]["Import RT  (separated by commas)"] = new_import
-            vrf_list[device_name][vrf]["Export RT  (separated by commas)"] = new_export
+        for device_name in self.device_list:
+            for row in self.GetDeviceRows(device_name,"vrf"):
+                vrf = row["VRF"]
+                if not self.vrf_list.get(device_name):
+                    self.vrf_list[device_name] = {}
+                if not self.vrf_list[device_name].get(vrf):
+                    self.vrf_list[device_name][vrf] = {}
+                self.vrf_list[device_name][vrf].update(row.items())
+                # If there are multiple route-targets grab them all
+                current_import = self.vrf_list[device_name][vrf]["Import RT  (separated by commas)"]
+                current_import = current_import.strip()
+                current_import = current_import.replace(" ","")
+                current_export = self.vrf_list[device_name][vrf]["Export RT  (separated by commas)"]
+                current_export = current_export.strip()
+                current_export = current_export.replace(" ","")
+                new_import = current_import.split(",")
+                new_export = current_export.split(",")
+                self.vrf_list[device_name][vrf]["Import RT  (separated by commas)"] = new_import
+                self.vrf_list[device_name][vrf]["Export RT  (separated by commas)"] = new_export
 
     #------------------------------------------------------------------
     # Create a database that contains the interfaces for each device
     #------------------------------------------------------------------
     def GetInterfaceList(self):
-        global interface_list
-        for row_no in range(len(raw_db["interfaces"])):
-            interface_columns = {key: [] for key in column_list["interfaces"]}
-            device_name = raw_db["interfaces"][row_no]["Device Name"]
-            port = raw_db["interfaces"][row_no]["Interface"]
-            if not interface_list.get(device_name):
-                interface_list[device_name] = {}
-            if not interface_list[device_name].get(port):
-                interface_list[device_name][port] = interface_columns
-            for column in interface_columns:
-                interface_list[device_name][port][column] = raw_db["interfaces"][row_no][column]
-            self.AddInterface(device_name,port,True)
+        for device_name in self.device_list:
+            for row in self.GetDeviceRows(device_name,"interfaces"):
+                port = row["Interface"]
+                if not self.interface_list.get(device_name):
+                    self.interface_list[device_name] = {}
+                if not self.interface_list[device_name].get(port):
+                    self.interface_list[device_name][port] = {}
+                self.interface_list[device_name][port].update(row.items())
+                self.AddInterface(device_name,port,True)
 
     #-------------------------------------------------------------------
     # Create a database that contains the static routes for each device
     #-------------------------------------------------------------------
     def GetStaticRouteList(self):
-        global static_route_list
-        for row_no in range(len(raw_db["static routes"])):
-            static_route_columns = {key: [] for key in column_list["static routes"]}
-            device_name = raw_db["static routes"][row_no]["Device Name"]
-            route = raw_db["static routes"][row_no]["Route (x.x.x.x/x)"]
-            if not static_route_list.get(device_name):
-                static_route_list[device_name] = {}
-            if not static_route_list[device_name].get(route):
-                static_route_list[device_name][route] = static_route_columns
-            for column in static_route_columns:
-                static_route_list[device_name][route][column] = raw_db["static routes"][row_no][column]
-
-            new_route = IPNetwork(route)
-            static_route_list[device_name][route]["Route"] = str(new_route.ip)
-            static_route_list[device_name][route]["Subnet"] = str(new_route.netmask)
+        for device_name in self.device_list:
+            for row in self.GetDeviceRows(device_name,"static routes"):
+                route = row["Route (x.x.x.x/x)"]
+                if not self.static_route_list.get(device_name):
+                    self.static_route_list[device_name] = {}
+                if not self.static_route_list[device_name].get(route):
+                    self.static_route_list[device_name][route] = {}
+                self.static_route_list[device_name][route].update(row.items())
+
+                new_route = IPNetwork(route)
+                self.static_route_list[device_name][route]["Route"] = str(new_route.ip)
+                self.static_route_list[device_name][route]["Subnet"] = str(new_route.netmask)
 
 
     def GetPrefixList(self):
-        global prefix_list
-        for row_no in range(len(raw_db["prefix-list"])):
-            device_name = raw_db["prefix-list"][row_no]["Device Name"]
-            prefix_name = raw_db["prefix-list"][row_no]["Prefix-List Name"]
-            prefix_seq  = raw_db["prefix-list"][row_no]["Prefix-List Sequence No"]
-            prefix_action  = raw_db["prefix-list"][row_no]["Prefix-List Action (permit/deny)"]
-            prefix_entry  = raw_db["prefix-list"][row_no]["Prefix-List Entry"]
-            if not prefix_list.get(device_name):
-                prefix_list[device_name] = {}
-            if not prefix_list[device_name].get(prefix_name):
-                temp_list = []
-                prefix_list[device_name][prefix_name] = temp_list
-                temp_db = {"sequence":"","action":"","entry":""}
-                prefix_list[device_name][prefix_name].append(temp_db)
-                prefix_list[device_name][prefix_name][0]["sequence"] = prefix_seq
-                prefix_list[device_name][prefix_name][0]["action"] = prefix_action
-                prefix_list[device_name][prefix_name][0]["entry"] = prefix_entry
-            elif not self.GetPrefixSeqNo(device_name,prefix_name,prefix_seq):
-                list_no = len(prefix_list[device_name][prefix_name])
-                temp_db = {"sequence":"","action":"","entry":""}
-                prefix_list[device_name][prefix_name].append(temp_db)
-                prefix_list[device_name][prefix_name][list_no]["sequence"] = prefix_seq
-                prefix_list[device_name][prefix_name][list_no]["action"] = prefix_action
-                prefix_list[device_name][prefix_name][list_no]["entry"] = prefix_entry
+        for device_name in self.device_list:
+            for row in self.GetDeviceRows(device_name,"prefix-list"):
+                prefix_name = row["Prefix-List Name"]
+                prefix_seq  = row["Prefix-List Sequence No"]
+                prefix_action  = row["Prefix-List Action (permit/deny)"]
+                prefix_entry  = row["Prefix-List Entry"]
+                if not self.prefix_list.get(device_name):
+                    self.prefix_list[device_name] = {}
+                if not self.prefix_list[device_name].get(prefix_name):
+                    self.prefix_list[device_name][prefix_name] = PrefixList()
+                # Duplicate sequence numbers are ignored (first one is used)
+                self.prefix_list[device_name][prefix_name].AddEntry(prefix_seq,prefix_action,prefix_entry)
 
 
     def GetPortChannelList(self):
-        global portchannel_list
-        for row_no in range(len(raw_db["portchannels"])):
-            portchannel_column = {key: [] for key in column_list["portchannels"]}
-            device_name = raw_db["portchannels"][row_no]["Device Name"]
-            interface = raw_db["portchannels"][row_no]["Interface"]
-            if not portchannel_list.get(device_name):
-                portchannel_list[device_name] = {}
-            if not portchannel_list[device_name].get(interface):
-                portchannel_list[device_name][interface] = portchannel_column
-            for column in portchannel_column:
-                portchannel_list[device_name][interface][column] = raw_db["portchannels"][row_no][column]
+        for device_name in self.device_list:
+            for row in self.GetDeviceRows(device_name,"portchannels"):
+                interface = row["Interface"]
+                if not self.portchannel_list.get(device_name):
+                    self.portchannel_list[device_name] = {}
+                if not self.portchannel_list[device_name].get(interface):
+                    self.portchannel_list[device_name][interface] = {}
+                self.portchannel_list[device_name][interface].update(row.items())
         self.UpdatePortChannels()
 
 
@@ -255,104 +1046,266 @@ class Config(object):
     # or member interfaces.
 
     def UpdatePortChannels(self):
-        for device_name in sorted(portchannel_list):
-            for interface in sorted(portchannel_list[device_name]):
+        for device_name in sorted(self.portchannel_list):
+            for interface in sorted(self.portchannel_list[device_name]):
 
-                pc_enabled = portchannel_list[device_name][interface]["Interface Enabled (yes/no)"]
-                pc_group = portchannel_list[device_name][interface]["Port-Channel Group"]
-                pc_mode = portchannel_list[device_name][interface]["Port-Channel Mode (active/on/etc)"]
-                pc_type = portchannel_list[device_name][interface]["Port-Channel Type (layer2 or layer3)"]
-                pc_members = portchannel_list[device_name][interface]["Port-Channel Members (separated by commas)"]
-                pc_description = portchannel_list[device_name][interface]["Description"]
+                pc_enabled = self.portchannel_list[device_name][interface]["Interface Enabled (yes/no)"]
+                pc_group = self.portchannel_list[device_name][interface]["Port-Channel Group"]
+                pc_mode = self.portchannel_list[device_name][interface]["Port-Channel Mode (active/on/etc)"]
+                pc_type = self.portchannel_list[device_name][interface]["Port-Channel Type (layer2 or layer3)"]
+                pc_members = self.portchannel_list[device_name][interface]["Port-Channel Members (separated by commas)"]
+                pc_description = self.portchannel_list[device_name][interface]["Description"]
 
                 self.AddInterface(device_name,interface)
                 if pc_enabled:
-                    interface_list[device_name][interface]["Interface Enabled (yes/no)"] = pc_enabled
+                    self.interface_list[device_name][interface]["Interface Enabled (yes/no)"] = pc_enabled
                 if pc_description:
-                    interface_list[device_name][interface]["Description"] = pc_description
+                    self.interface_list[device_name][interface]["Description"] = pc_description
 
                 for member in pc_members.split(","):
                     member = member.strip()
                     self.AddInterface(device_name,member)
-                    interface_list[device_name][member]["PC-Group"] = pc_group
-                    interface_list[device_name][member]["PC-Mode"] = pc_mode
-                    interface_list[device_name][member]["PC-Type"] = pc_type
-                    interface_list[device_name][interface]["PC-Members"].append(member)
-
+                    self.interface_list[device_name][member]["PC-Group"] = pc_group
+                    self.interface_list[device_name][member]["PC-Mode"] = pc_mode
+                    self.interface_list[device_name][member]["PC-Type"] = pc_type
+                    self.interface_list[device_name][interface]["PC-Members"].append(member)
+
+    #---------------------------------------------------------------------------
+    # Variable values and config templates can use [name] to pull in another
+    # variable, and a template can have another template's [name] on a line of
+    # its own. Each one is expanded once, after everything it references (see
+    # SortDependencies), and the expanded value is what GetVariable() and
+    # GetConfigTemplate() return. Loops are reported with their row numbers
+    # and the names in a loop are left as they are.
+    #
+    # A variable with a "Scope (leave blank if global)" only applies to the
+    # device of that name, or to the devices whose profiles have that
+    # "Site/Group". A device sees its own variables first, then its site/group
+    # variables and then the global ones (see GetDeviceScope).
+    #---------------------------------------------------------------------------
     def GetVariableList(self):
-        global variable_list
-        for row_no in range(len(raw_db["variables"])):
-            variable_name = raw_db["variables"][row_no]["Variable"]
-            variable_value = raw_db["variables"][row_no]["Variable Value"]
+        for row in self.raw_db["variables"]:
+            variable_name = row["Variable"]
+            variable_value = row["Variable Value"]
+            scope = row.get("Scope (leave blank if global)")
             if "+" in variable_name:
                 continue
-            elif variable_name in variable_list:
+            # Skip the variables of a commented out device or site/group, the
+            # same as the rows of a commented out device
+            if scope and self.CleanDeviceName(scope) is None:
+                continue
+            scope = self.CleanDeviceName(scope) or ""
+            if scope not in self.variable_values:
+                self.variable_values[scope] = {}
+                self.variable_rows[scope] = {}
+            if variable_name in self.variable_values[scope]:
+                continue
+            self.variable_values[scope][variable_name] = variable_value
+            self.variable_rows[scope][variable_name] = row["Row"]
+        values = self.variable_values.get("", {})
+        for variable_name, names in self.GetVariableReferences(values).items():
+            for name in names:
+                self.variable_users.setdefault(name, []).append(variable_name)
+        self.variable_list, self.variable_loops = self.ExpandVariables(values,self.variable_rows.get("", {}),self.error_db["variables"])
+        self.expansion_errors.update(self.FormatError(entry) for entry in self.error_db["variables"])
+
+    # The names each variable value refers to, for the values that have a [name]
+    def GetVariableReferences(self,values):
+        references = {}
+        for variable_name, variable_value in values.items():
+            if isinstance(variable_value, str) and "[" in variable_value:
+                references[variable_name] = ConfigTemplate.SLOT.findall(variable_value)
+        return references
+
+    # Expands values and returns them with the names found in a loop. Names that
+    # aren't in values are looked up in base (the expanded global variables),
+    # apart from the ones in base_looped
+    def ExpandVariables(self,values,rows,errors,base=None,base_looped=()):
+        variables = dict(values)
+        compiled_variables = {}
+        for variable_name in self.GetVariableReferences(values):
+            compiled_variables[variable_name] = ConfigTemplate([variables[variable_name]])
+        references = {name: compiled.GetNames() for name, compiled in compiled_variables.items()}
+        order, cycles, looped = SortDependencies(references)
+        for cycle in cycles:
+            errors.append(self.GetErrorRecord("variables",rows[cycle[0]],None,cycle[0],"is part of a loop: {}".format(
+                " -> ".join("'{}' (row {})".format(name,rows[name]) for name in cycle))))
+
+        def get_value(name):
+            if name in looped:
+                return None
+            if name in variables:
+                return variables[name]
+            if base is not None and name not in base_looped:
+                return base.get(name)
+        for variable_name in order:
+            if variable_name in looped:
                 continue
-            variable_list[variable_name] = variable_value
+            lines, missing = compiled_variables[variable_name].Render(get_value)
+            variables[variable_name] = lines[0]
+        return variables, looped
 
     def GetConfigTemplateList(self):
-        global config_templates
-        temp_list = []
-        for row_no in range(len(raw_db["config-templates"])):
-            line = raw_db["config-templates"][row_no]["Enter config templates below this line:"]
-            match = re.search(r'Config Template: \[(.*?)\]', line,re.IGNORECASE)
+        template = None
+        split_lines = {}
+        for row in self.raw_db["config-templates"]:
+            line = row["Enter config templates below this line:"]
             if not line:
                 continue
+            match = "[" in line and ConfigTemplate.HEADER.search(line)
             if match:
-                temp_list = []
-                config_templates[match.group(1)] = temp_list
+                template = ConfigTemplate()
+                self.template_sources[match.group(1)] = template
+                self.template_rows[match.group(1)] = row["Row"]
                 continue
-            temp_list.append(line)
-
-        # Cycle through each line of the config template to update dynamic variables
-        for entry in config_templates:
-            temp_list = []
-            for line in config_templates[entry]:
-                match = re.findall(r'\[(.*?)\]', line)
-                valid_variable = False
-                if (match):
-                    for variable_name in match:
-                        lookup_variable = self.GetVariable(variable_name)
-                        if lookup_variable:
-                            valid_variable = True
-                            line = line.replace(variable_name,lookup_variable)
-                        else:
-                            error_db["config-templates"].append("Config-Template: '{}' referenced embedded variable '{}' which does not exist".format(entry,variable_name))
-                            continue
-                    if (valid_variable):
-                        line = line.replace("[","")
-                        line = line.replace("]","")
-                temp_list.append(line)
-            config_templates[entry] = temp_list
-
-
+            if template is not None:
+                template.AddLine(line,split_lines)
+        for entry, template in self.template_sources.items():
+            for name in set(template.GetNames()):
+                self.template_users.setdefault(name, []).append(entry)
+        self.config_templates, self.template_loops = self.ExpandConfigTemplates(self.variable_list.get,self.error_db["config-templates"])
+        self.expansion_errors.update(self.FormatError(entry) for entry in self.error_db["config-templates"])
+
+    # Expands the config templates in entries (all of them by default) and
+    # returns them with the names found in a loop. Included templates that
+    # aren't in entries come from base (apart from the ones in base_looped)
+    def ExpandConfigTemplates(self,get_value,errors,entries=None,base=None,base_looped=()):
+        if entries is None:
+            entries = self.template_sources
+        references = {}
+        for entry in entries:
+            references[entry] = [name for name in self.template_sources[entry].GetIncludes() if not get_value(name)]
+        order, cycles, looped = SortDependencies(references)
+        for cycle in cycles:
+            errors.append(self.GetErrorRecord("config-templates",self.template_rows[cycle[0]],None,cycle[0],"is part of a loop: {}".format(
+                " -> ".join("'{}' (row {})".format(name,self.template_rows[name]) for name in cycle))))
+
+        # Expand each config template once, after the templates it includes
+        expanded = {}
+        missing = {}
+        rendered_lines = {}
+        def get_template(name):
+            if name in looped:
+                return None
+            if name in expanded:
+                return expanded[name]
+            if base is not None and name not in base_looped:
+                return base.get(name)
+        for entry in order:
+            expanded[entry], missing[entry] = self.template_sources[entry].Render(get_value,get_template,rendered_lines)
+        for entry in entries:
+            for variable_name in missing[entry]:
+                if variable_name in looped:
+                    continue
+                errors.append(self.GetErrorRecord("config-templates",None,None,entry,"referenced embedded variable '{}' which does not exist".format(variable_name)))
+        return expanded, looped
+
+    #-------------------------------------------------------------------------------
+    # The scope of a device is the site/group (the first "Site/Group" in its
+    # profiles) and the device itself, leaving out either one that doesn't have
+    # any variables. Each different scope is worked out once and shared by every
+    # device with the same scope. Only the variables that are set in the scope,
+    # or that refer (through other variables) to one that is, are expanded again,
+    # along with the config templates that use any of those or include one of
+    # the templates that changed. Everything else comes from the global
+    # variable_list and config_templates, i.e. GetVariable() looks in the
+    # device's scope first and then the global list. Errors that only happen in
+    # a scope are reported with the scope after them.
+    #-------------------------------------------------------------------------------
+    def GetDeviceScope(self,device_name):
+        if device_name in self.device_scopes:
+            return self.device_scopes[device_name]
+        group = None
+        for row in self.GetDeviceRows(device_name,"profiles"):
+            group = self.CleanDeviceName(row.get("Site/Group"))
+            if group:
+                break
+        scope = tuple(name for name in (group, device_name) if name in self.variable_values)
+        if scope and scope not in self.variable_scopes:
+            values = {}
+            rows = {}
+            for name in scope:
+                values.update(self.variable_values[name])
+                rows.update(self.variable_rows[name])
+            changed_variables = self.GetUsers(values,self.variable_users)
+            global_values = self.variable_values.get("", {})
+            global_rows = self.variable_rows.get("", {})
+            for variable_name in global_values:
+                if variable_name in changed_variables and variable_name not in values:
+                    values[variable_name] = global_values[variable_name]
+                    rows[variable_name] = global_rows[variable_name]
+            variable_errors = []
+            template_errors = []
+            variables, looped = self.ExpandVariables(values,rows,variable_errors,self.variable_list,self.variable_loops)
+
+            def get_value(name):
+                if name in variables:
+                    return variables[name]
+                return self.variable_list.get(name)
+            changed_names = self.GetUsers(changed_variables,self.template_users)
+            changed_templates = [entry for entry in self.template_sources if entry in changed_names]
+            config_templates, looped = self.ExpandConfigTemplates(get_value,template_errors,changed_templates,
+                                                                  self.config_templates,self.template_loops)
+            self.variable_scopes[scope] = {"Variables": variables, "Config Templates": config_templates}
+            for worksheet, errors in (("variables", variable_errors), ("config-templates", template_errors)):
+                for entry in errors:
+                    if self.FormatError(entry) not in self.expansion_errors:
+                        entry["Scope"] = list(scope)
+                        self.error_db[worksheet].append(entry)
+        self.device_scopes[device_name] = scope
+        return scope
+
+    # names plus everything that uses them, directly or through one another,
+    # going by users ({name: [names that use it]})
+    def GetUsers(self,names,users):
+        found = set(names)
+        stack = list(found)
+        while stack:
+            for user in users.get(stack.pop(), ()):
+                if user not in found:
+                    found.add(user)
+                    stack.append(user)
+        return found
+
+    #-----------------------------------------------------------------------------
+    # Besides the "Profile" and "Position" of each row, the rendered text of each
+    # profile (see GetProfileBlock) is put in a "Start" and/or "End" list, so
+    # CreateGlobalConfig only has to add the blocks for its position in order
+    #-----------------------------------------------------------------------------
     def GetProfileList(self):
-        global profile_list
-        global error_db
-        for row_no in range(len(raw_db["profiles"])):
-            device_name = raw_db["profiles"][row_no]["Device Name"]
-            variable = raw_db["profiles"][row_no]["Template or Variable"]
-            position = raw_db["profiles"][row_no]["Position (Default: Start)"]
-            if not position:
-                position = "Start"
-            if not self.GetVariable(variable):
-                if not self.GetConfigTemplate(variable):
-                    error_db["profiles"].append("Row ({}): Device '{}' referenced variable '{}' which does not exist".format(raw_db["profiles"][row_no]["Row"],device_name,variable))
+        for device_name in self.device_list:
+            self.GetDeviceScope(device_name)
+            for row in self.GetDeviceRows(device_name,"profiles"):
+                variable = row["Template or Variable"]
+                position = row["Position (Default: Start)"]
+                if not position:
+                    position = "Start"
+                block = self.GetProfileBlock(variable,device_name)
+                if not block:
+                    self.error_db["profiles"].append(self.GetErrorRecord("profiles",row["Row"],device_name,variable,
+                                                                         "referenced variable '{}' which does not exist".format(variable)))
                     continue
 
-#            if device_name not in profile_list:
-#                temp_list = []
-#                profile_list[device_name] = temp_list
-#            profile_list[device_name].append(variable)
-
-            if device_name not in profile_list:
-                profile_temp = []
-                position_temp = []
-                profile_list[device_name] = {}
-                profile_list[device_name]["Profile"] = profile_temp
-                profile_list[device_name]["Position"] = position_temp
-            profile_list[device_name]["Profile"].append(variable)
-            profile_list[device_name]["Position"].append(position)
+#                if device_name not in profile_list:
+#                    temp_list = []
+#                    profile_list[device_name] = temp_list
+#                profile_list[device_name].append(variable)
+
+                if device_name not in self.profile_list:
+                    profile_temp = []
+                    position_temp = []
+                    self.profile_list[device_name] = {}
+                    self.profile_list[device_name]["Profile"] = profile_temp
+                    self.profile_list[device_name]["Position"] = position_temp
+                    self.profile_list[device_name]["Start"] = []
+                    self.profile_list[device_name]["End"] = []
+                self.profile_list[device_name]["Profile"].append(variable)
+                self.profile_list[device_name]["Position"].append(position)
+                for config_position in ("Start", "End"):
+                    if config_position in position:
+                        self.profile_list[device_name][config_position].append(block)
+        # The errors are found one device at a time, so put them back in row order
+        self.error_db["profiles"].sort(key=itemgetter("Row"))
 
 
     #-------------------------------------------
@@ -364,51 +1317,55 @@ class Config(object):
         b) UpdatePortChannels is called (i.e. only if new interface is detected)
     '''
     def AddInterface(self,device_name,interface,manual_entries=False):
-        global interface_list
 
-        interface_columns = {key: [] for key in column_list["interfaces"]}
-        if not interface_list.get(device_name):
-            interface_list[device_name] = {}
-        if not interface_list[device_name].get(interface):
+        interface_columns = {key: [] for key in self.column_list["interfaces"]}
+        if not self.interface_list.get(device_name):
+            self.interface_list[device_name] = {}
+        if not self.interface_list[device_name].get(interface):
             manual_entries = True
-            interface_list[device_name][interface] = interface_columns
+            self.interface_list[device_name][interface] = interface_columns
 
         # Any manual entries that are not directly from the spreadsheet below
         if manual_entries:
             error_list = []
             member_list = []
-            interface_list[device_name][interface]["Errors"] = error_list
-            interface_list[device_name][interface]["Interface"] = interface
-            interface_list[device_name][interface]["PC-Group"] = ""
-            interface_list[device_name][interface]["PC-Mode"] = ""
-            interface_list[device_name][interface]["PC-Type"] = ""
-            interface_list[device_name][interface]["PC-Members"] = member_list
-            interface_list[device_name][interface]["PC-Parent"] = ""
+            self.interface_list[device_name][interface]["Errors"] = error_list
+            self.interface_list[device_name][interface]["Interface"] = interface
+            self.interface_list[device_name][interface]["PC-Group"] = ""
+            self.interface_list[device_name][interface]["PC-Mode"] = ""
+            self.interface_list[device_name][interface]["PC-Type"] = ""
+            self.interface_list[device_name][interface]["PC-Members"] = member_list
+            self.interface_list[device_name][interface]["PC-Parent"] = ""
 
     # ---------------------------------------------------
     # Get specific values from their respective database
     # ---------------------------------------------------
-    def GetVariable(self, variable_name):
-        if variable_list.get(variable_name):
-            return variable_list[variable_name]
+    def GetVariable(self, variable_name, device_name=None):
+        variables = self.variable_list
+        scope = self.device_scopes.get(device_name)
+        if scope and variable_name in self.variable_scopes[scope]["Variables"]:
+            variables = self.variable_scopes[scope]["Variables"]
+        if variables.get(variable_name):
+            return variables[variable_name]
 
     def GetVlan(self, device_to_find, vlan_to_find):
-        if vlan_list[device_to_find].get(vlan_to_find):
-            return vlan_list[device_to_find][vlan_to_find]
-
-    def GetConfigTemplate(self, template_name):
+        if self.vlan_list[device_to_find].get(vlan_to_find):
+            return self.vlan_list[device_to_find][vlan_to_find]
+
+    def GetConfigTemplate(self, template_name, device_name=None):
+        config_templates = self.config_templates
+        scope = self.device_scopes.get(device_name)
+        if scope and template_name in self.variable_scopes[scope]["Config Templates"]:
+            config_templates = self.variable_scopes[scope]["Config Templates"]
         if config_templates.get(template_name):
             return config_templates[template_name]
 
     def GetPrefixSeqNo(self, device_name,prefix_name,sequence_number):
-        global prefix_list
-        if not prefix_list.get(device_name):
+        if not self.prefix_list.get(device_name):
             return
-        if not prefix_list[device_name].get(prefix_name):
+        if not self.prefix_list[device_name].get(prefix_name):
             return
-        for row, entry in enumerate(prefix_list[device_name][prefix_name]):
-            if prefix_list[device_name][prefix_name][row]["sequence"] == sequence_number:
-                return prefix_list[device_name][prefix_name][row]
+        return self.prefix_list[device_name][prefix_name].GetEntry(sequence_number)
 
     def GetIP(self,IP_address,mode="IOS"):
         if not IP_address:
@@ -432,158 +1389,142 @@ class Config(object):
         return "Physical"
 
     def GetTrunkVlans(self,device,interface):
-        if not interface_list[device][interface].get("Trunk Allowed VLANs (separated by commas)"):
+        if not self.interface_list[device][interface].get("Trunk Allowed VLANs (separated by commas)"):
+            return
+        allowed_vlans_raw = self.interface_list[device][interface]["Trunk Allowed VLANs (separated by commas)"]
+        try:
+            return VlanRanges.FromString(allowed_vlans_raw)
+        except ValueError:
             return
-        allowed_vlans_raw = interface_list[device][interface]["Trunk Allowed VLANs (separated by commas)"]
-        allowed_vlans_raw = allowed_vlans_raw.replace(" ","")
-        allowed_vlans_raw = allowed_vlans_raw.strip()
-        allowed_vlans_raw = allowed_vlans_raw.split(",")
-        allowed_vlans_new = []
-
-        for vlan in allowed_vlans_raw:
-            if "-" not in vlan:
-                allowed_vlans_new.append(vlan)
-            elif "-" in vlan:
-                vlan_range = []
-                for entry in vlan.split("-"):
-                    vlan_range.append(entry)
-                vlan_range_start = int(vlan_range[0])
-                vlan_range_end = int(vlan_range[1])
-
-                while vlan_range_start <= vlan_range_end:
-                    allowed_vlans_new.append(vlan_range_start)
-                    vlan_range_start +=1
-        return allowed_vlans_new
 
     # ---------------------------------------------
     # Check the interface for specific conditions
     # ---------------------------------------------
     def is_switch_port(self,device,interface):
-        if interface_list[device][interface]["Data VLAN"]:
+        if self.interface_list[device][interface]["Data VLAN"]:
             return True
-        elif interface_list[device][interface]["Voice VLAN"]:
+        elif self.interface_list[device][interface]["Voice VLAN"]:
             return True
-        elif interface_list[device][interface]["Trunk Allowed VLANs (separated by commas)"]:
+        elif self.interface_list[device][interface]["Trunk Allowed VLANs (separated by commas)"]:
             return True
-        elif "layer2" in interface_list[device][interface]["PC-Type"]:
+        elif "layer2" in self.interface_list[device][interface]["PC-Type"]:
             return True
 
     def is_routed_port(self,device,interface):
         if "Logical" in self.GetInterfaceType(interface):
             return False
-        elif interface_list[device][interface]["IP Address (x.x.x.x/x)"]:
+        elif self.interface_list[device][interface]["IP Address (x.x.x.x/x)"]:
             return True
-        elif "layer3" in interface_list[device][interface]["PC-Type"]:
+        elif "layer3" in self.interface_list[device][interface]["PC-Type"]:
             return True
 
     def is_trunk_port(self,device,interface):
-        if interface_list[device][interface].get("Trunk Allowed VLANs (separated by commas)"):
+        if self.interface_list[device][interface].get("Trunk Allowed VLANs (separated by commas)"):
             return True
 
     def is_data_port(self,device,interface):
-        if interface_list[device][interface].get("Data VLAN"):
+        if self.interface_list[device][interface].get("Data VLAN"):
             return True
 
     def is_voice_port(self,device,interface):
-        if interface_list[device][interface].get("Voice VLAN"):
+        if self.interface_list[device][interface].get("Voice VLAN"):
             return True
 
     def is_interface_enabled(self,device,interface):
-        if interface_list[device][interface]["Interface Enabled (yes/no)"]:
-            if "yes" in interface_list[device][interface]["Interface Enabled (yes/no)"]:
+        if self.interface_list[device][interface]["Interface Enabled (yes/no)"]:
+            if "yes" in self.interface_list[device][interface]["Interface Enabled (yes/no)"]:
                 return True
-            if "Yes" in interface_list[device][interface]["Interface Enabled (yes/no)"]:
+            if "Yes" in self.interface_list[device][interface]["Interface Enabled (yes/no)"]:
                 return True
 
     def is_portchannel_member(self,device,interface):
-        if interface_list[device][interface]["PC-Group"]:
+        if self.interface_list[device][interface]["PC-Group"]:
             return True
 
     def is_portchannel_parent(self,device,interface):
-        if interface_list[device][interface]["PC-Members"]:
+        if self.interface_list[device][interface]["PC-Members"]:
             return True
 
     def is_valid_portchannel(self,device,interface):
-        if portchannel_list[device].get(interface):
-            if interface_list[device][interface]:
+        if self.portchannel_list[device].get(interface):
+            if self.interface_list[device][interface]:
                 return True
 
-    def is_valid_variable(self,variable_name):
-        if variable_list.get(variable_name):
+    def is_valid_variable(self,variable_name,device_name=None):
+        if self.GetVariable(variable_name,device_name):
             return True
 
     def is_valid_vlan(self,device,vlan):
-        if vlan_list.get(device):
-            if vlan_list[device].get(int(vlan)):
+        if self.vlan_bitmaps.get(device):
+            if int(vlan) in self.vlan_bitmaps[device]:
                 return True
 
     def is_valid_trunk(self,device,interface):
         if not self.is_trunk_port(device,interface):
             return False
         trunk_vlans = self.GetTrunkVlans(device,interface)
-        valid_trunk = True
-        for vlan in trunk_vlans:
-            if not self.is_valid_vlan(device,vlan):
-                valid_trunk = False
-        if valid_trunk:
+        if trunk_vlans is None:
+            return False
+        if not trunk_vlans:
+            return True
+        if self.vlan_bitmaps.get(device) and self.vlan_bitmaps[device].Covers(trunk_vlans):
             return True
 
     def is_valid_vrf(self,device,vrf):
-        if vrf_list.get(device):
-            if vrf_list[device].get(vrf):
+        if self.vrf_list.get(device):
+            if self.vrf_list[device].get(vrf):
                 return True
 
     def is_valid_ipaddress(self,ip_address_to_check):
-        ip_address = IPNetwork(ip_address_to_check)
-        if IPAddress(ip_address.ip) in IPNetwork(ip_address).iter_hosts():
+        if is_host_address(IPNetwork(ip_address_to_check)):
             return True
 
     def has_variable1_configured(self,device,interface):
-        if interface_list[device][interface].get("Variable 1"):
+        if self.interface_list[device][interface].get("Variable 1"):
             return True
 
     def has_variable2_configured(self,device,interface):
-        if interface_list[device][interface].get("Variable 2"):
+        if self.interface_list[device][interface].get("Variable 2"):
             return True
 
     def has_description_configured(self,device,interface):
-        if interface_list[device][interface]["Description"]:
+        if self.interface_list[device][interface]["Description"]:
             return True
 
     def has_mtu_configured(self,device,interface):
-        if interface_list[device][interface]["MTU"]:
+        if self.interface_list[device][interface]["MTU"]:
             return True
 
     def has_vrf_configured(self,device,interface):
-        if interface_list[device][interface]["VRF (leave blank if global)"]:
+        if self.interface_list[device][interface]["VRF (leave blank if global)"]:
             return True
 
     def has_ip_configured(self,device,interface):
-        if interface_list[device][interface]["IP Address (x.x.x.x/x)"]:
+        if self.interface_list[device][interface]["IP Address (x.x.x.x/x)"]:
             return True
 
     def has_nativevlan_configured(self,device,interface):
-        if interface_list[device][interface]["Trunk Native VLAN"]:
+        if self.interface_list[device][interface]["Trunk Native VLAN"]:
             return True
 
     def has_speed_configured(self,device,interface):
-        if interface_list[device][interface]["Speed"]:
+        if self.interface_list[device][interface]["Speed"]:
             return True
 
     def has_duplex_configured(self,device,interface):
-        if interface_list[device][interface]["Duplex"]:
+        if self.interface_list[device][interface]["Duplex"]:
             return True
 
     def has_importrt_configured(self,device,vrf):
-        if vrf_list[device][vrf].get("Import RT  (separated by commas)"):
+        if self.vrf_list[device][vrf].get("Import RT  (separated by commas)"):
             return True
 
     def has_exportrt_configured(self,device,vrf):
-        if vrf_list[device][vrf].get("Export RT  (separated by commas)"):
+        if self.vrf_list[device][vrf].get("Export RT  (separated by commas)"):
             return True
 
     def has_rd_configured(self,device,vrf):
-        if vrf_list[device][vrf].get("RD"):
+        if self.vrf_list[device][vrf].get("RD"):
             return True
 
 
@@ -592,9 +1533,9 @@ class Config(object):
     # Check each worksheet/row to make sure that the required information is present.
     # Otherwise the row will be removed from the database as it will be considered invalid
     # -------------------------------------------------------------------------------------
-    def RemoveEmptyRowsFromDB(self):
+    def SetRequiredColumns(self):
 
-        db_required_columns = {key: [] for key in worksheet_list}
+        db_required_columns = {key: [] for key in self.worksheet_list}
         #--------------------------------------------------------------------
         # If the worksheet needs to have a valid column entry, define it below
         #--------------------------------------------------------------------
@@ -606,127 +1547,324 @@ class Config(object):
         db_required_columns["static routes"]= ["Device Name","Route (x.x.x.x/x)","Next Hop"]
         db_required_columns["portchannels"]= ["Device Name","Interface","Port-Channel Group","Port-Channel Mode (active/on/etc)","Port-Channel Type (layer2 or layer3)","Port-Channel Members (separated by commas)"]
 
-        #--------------------------------------------
-        # Search for invalid rows and update database
-        #--------------------------------------------
-        console = sys.__stdout__
-        sys.stdout = Logger("ccg-ignored.txt")
-        for worksheet in worksheet_list:
-            for entry in db_required_columns[worksheet]:
-                temp_db = []
-                for row_no in range(len(raw_db[worksheet])):
-                    if not raw_db[worksheet][row_no][entry]:
-
-                        print ("[{}]-row:{} has empty cell value for column: {}  (IGNORED)".format(worksheet,raw_db[worksheet][row_no]["Row"],entry))
-                        continue
-                    if "$" in str(raw_db[worksheet][row_no][entry]):
-                        continue
-                    temp_db.append(raw_db[worksheet][row_no])
+        #------------------------------------------------------------------
+        # Look up the position of each required column once per worksheet
+        #------------------------------------------------------------------
+        self.required_columns = db_required_columns
+        self.required_positions = {}
+        for worksheet in self.worksheet_list:
+            self.required_positions[worksheet] = [(self.column_index[worksheet][entry],entry) for entry in db_required_columns[worksheet]]
+
+    #------------------------------------------------------------------
+    # Check a row against all of the required columns of its worksheet.
+    # The first column that is empty (logged in ignored_rows) or still
+    # has a "$" placeholder (not logged) means the row is removed
+    #------------------------------------------------------------------
+    def has_required_columns(self,worksheet,row):
+        for position,entry in self.required_positions[worksheet]:
+            value = row.values[position]
+            if not value:
+                self.ignored_rows.append({"Worksheet":worksheet,"Row":row["Row"],"Column":entry})
+                return False
+            if "$" in str(value):
+                return False
+        return True
+
+    #--------------------------------------------
+    # Search for invalid rows and update database
+    #--------------------------------------------
+    def RemoveEmptyRowsFromDB(self):
+        self.SetRequiredColumns()
+        for worksheet in self.worksheet_list:
+            if not self.required_positions[worksheet]:
+                continue
+            temp_db = []
+            for row in self.raw_db[worksheet]:
+                if self.has_required_columns(worksheet,row):
+                    temp_db.append(row)
                 else:
-                    raw_db[worksheet] = temp_db
-        sys.stdout = console
+                    self.RemoveFromDeviceDb(worksheet,row)
+            self.raw_db[worksheet] = temp_db
+
+    #-------------------------------------------------------------------
+    # List the rows removed by RemoveEmptyRowsFromDB (ccg-ignored.txt)
+    # Rows are listed by worksheet, then by required column, then by row
+    #-------------------------------------------------------------------
+    def CreateIgnoredReport(self):
+        column_order = {}
+        for worksheet in self.worksheet_list:
+            for column_no,entry in enumerate(self.required_columns[worksheet]):
+                column_order[worksheet,entry] = column_no
+        ignored_by_worksheet = {key: [] for key in self.worksheet_list}
+        for record in self.ignored_rows:
+            ignored_by_worksheet[record["Worksheet"]].append(record)
+
+        output = OutputBuffer()
+        for worksheet in self.worksheet_list:
+            if self.ingest_stats[worksheet]["Empty Rows"]:
+                output.AddLine("[{}]-{} empty rows skipped  (IGNORED)".format(worksheet,self.ingest_stats[worksheet]["Empty Rows"]))
+            ignored_by_worksheet[worksheet].sort(key=lambda record: column_order[worksheet,record["Column"]])
+            for record in ignored_by_worksheet[worksheet]:
+                output.AddLine("[{}]-row:{} has empty cell value for column: {}  (IGNORED)".format(worksheet,record["Row"],record["Column"]))
+        return output
+
+    def GenerateIgnoredReport(self):
+        self.CreateIgnoredReport().WriteFile("ccg-ignored.txt")
+
+    #---------------------------------------------------------------------------
+    # Streaming mode (--stream). If every worksheet with a "Device Name" column
+    # is sorted by device name, the worksheets can be read side by side and each
+    # device built, checked and generated before the next device's rows are
+    # read, so only one device is held in memory. The worksheets without a
+    # device name (variables, config-templates) are read in full first.
+    # Worksheets that aren't sorted can be sorted on disk first (--spill).
+    #
+    # IterSortedDevices() checks the order as it goes (see unsorted_worksheets).
+    # GetUnsortedWorksheets() checks it up front instead, for callers that can't
+    # take back what has already been generated (i.e. IterConfigs). It has to
+    # parse every row of every device worksheet to do it, i.e. the device
+    # worksheets are decoded twice.
+    #---------------------------------------------------------------------------
+    def GetUnsortedWorksheets(self):
+        wb = self.workbook
+        unsorted_worksheets = []
+        for worksheet_name in wb.GetSheetNames():
+            if worksheet_name == "Instructions":
+                continue
+            rows = wb.IterRows(worksheet_name)
+            header = list(next(rows, []))
+            if "Device Name" not in header:
+                rows.close()
+                continue
+            position = header.index("Device Name")
+            last_device = None
+            for cells in rows:
+                value = cells[position] if position < len(cells) else ""
+                if isinstance(value, float):
+                    value = int(value)
+                device_name = self.CleanDeviceName(value)
+                if device_name is None:
+                    continue
+                if last_device is not None and device_name < last_device:
+                    rows.close()
+                    unsorted_worksheets.append(worksheet_name)
+                    break
+                last_device = device_name
+        return unsorted_worksheets
+
+    def ClearDeviceLists(self):
+        self.device_db = {}
+        self.device_list = []
+        self.device_scopes = {}
+        self.profile_list = {}
+        self.vlan_list = {}
+        self.vlan_bitmaps = {}
+        self.vrf_list = {}
+        self.interface_list = {}
+        self.static_route_list = {}
+        self.prefix_list = {}
+        self.portchannel_list = {}
+
+    # With check_sorted the rows stop (and the worksheet is added to
+    # unsorted_worksheets) at the first device name that goes backwards
+    def IterDeviceRows(self,worksheet_name,rows,check_sorted=False):
+        last_device = None
+        for record in self.IterRecords(worksheet_name,rows):
+            if not self.has_required_columns(worksheet_name,record):
+                continue
+            device_name = self.GetDeviceName(record)
+            if device_name is None:
+                continue
+            if check_sorted:
+                if last_device is not None and device_name < last_device:
+                    self.unsorted_worksheets.append(worksheet_name)
+                    rows.close()
+                    return
+                last_device = device_name
+            yield device_name, worksheet_name, record
+
+    #-------------------------------------------------------------------------
+    # Same as IterDeviceRows() for a worksheet that isn't sorted by device name.
+    # The rows are sorted on disk, max_rows at a time (see SortedRuns). Only the
+    # cell values are written out, the row number keeps the worksheet order
+    # for rows of the same device.
+    #-------------------------------------------------------------------------
+    def IterSpilledDeviceRows(self,worksheet_name,rows,max_rows):
+        columns = self.column_index[worksheet_name]
+        sorted_runs = SortedRuns(max_rows)
+        for device_name, worksheet_name, record in self.IterDeviceRows(worksheet_name,rows):
+            sorted_runs.AddEntry((device_name,record["Row"]),record.values)
+        for (device_name, row_no), values in sorted_runs:
+            yield device_name, worksheet_name, RowRecord(columns, values)
+
+    #---------------------------------------------------------------------
+    # Yields each device name once its lists have been built and checked
+    # (the lists only hold that device until the next one is asked for)
+    # The worksheets in spill_worksheets are sorted on disk first, any
+    # other worksheet with a device name must already be sorted. If one
+    # isn't, it's added to unsorted_worksheets and no more devices are
+    # yielded (the ones already yielded may be missing rows)
+    #---------------------------------------------------------------------
+    def IterSortedDevices(self,spill_worksheets=(),spill_rows=0):
+        wb = self.workbook
+        device_worksheets = []
+        for worksheet_name in wb.GetSheetNames():
+            if worksheet_name == "Instructions":
+                continue
+            rows = wb.IterRows(worksheet_name)
+            self.AddWorksheet(worksheet_name,next(rows, []))
+            if "Device Name" in self.column_index[worksheet_name]:
+                device_worksheets.append((worksheet_name,rows))
+                self.raw_db[worksheet_name] = []
+            else:
+                self.raw_db[worksheet_name] = list(self.IterRecords(worksheet_name,rows))
+        self.RemoveEmptyRowsFromDB()
+        self.GetVariableList()
+        self.GetConfigTemplateList()
+
+        device_rows = []
+        for worksheet_name, rows in device_worksheets:
+            if worksheet_name in spill_worksheets:
+                device_rows.append(self.IterSpilledDeviceRows(worksheet_name,rows,spill_rows))
+            else:
+                device_rows.append(self.IterDeviceRows(worksheet_name,rows,check_sorted=True))
+        error_order = {}
+        for device_name, rows in itertools.groupby(heapq.merge(*device_rows, key=itemgetter(0)), itemgetter(0)):
+            self.ClearDeviceLists()
+            for device_name, worksheet_name, record in rows:
+                self.AddToDeviceDb(worksheet_name,record)
+            self.GetDeviceList()
+            self.GetVlanList()
+            self.GetProfileList()
+            self.GetVrfList()
+            self.GetInterfaceList()
+            self.GetStaticRouteList()
+            self.GetPrefixList()
+            self.GetPortChannelList()
+            self.CheckInterfacesForErrors()
+            error_order[device_name] = self.GetInterfaceErrorOrder(device_name)
+            if self.unsorted_worksheets:
+                break
+            yield device_name
+        self.ClearDeviceLists()
+        # The devices come out by name, so put their interface errors back in
+        # the order a normal run lists them in (see GetInterfaceDevices)
+        self.error_db["interfaces"].sort(key=lambda entry: error_order[entry["Device"]])
 
     #-------------------------------------------------------------
     # Functions to actually show the output of the configuration
     #-------------------------------------------------------------
 
-    def CreateGlobalConfig(self,device_name,config_position="Start"):
-        if not profile_list.get(device_name):
+    def CreateGlobalConfig(self,output,device_name,config_position="Start"):
+        if not self.profile_list.get(device_name):
             return
 
-        print ("!---------------------------------")
-        print ("! Global configuration ({}) ".format(config_position))
-        print ("!---------------------------------")
-        for number, profile in enumerate(profile_list[device_name]["Profile"]):
-            profile_name = profile_list[device_name]["Profile"][number]
-            profile_position_type = profile_list[device_name]["Position"][number]
-            if config_position not in profile_position_type:
-                continue
-            if self.GetConfigTemplate(profile_name):
-                print ("\n! [{}]:".format(profile_name))
-                for line in self.GetConfigTemplate(profile_name):
-                    print ("{}".format(line))
-            elif self.GetVariable(profile_name):
-                print ("\n! [{}]:".format(profile_name))
-                print ("{}".format(self.GetVariable(profile_name)))
-
-    def CreateVlanConfig(self,device_name):
-        if not vlan_list.get(device_name):
+        output.AddLine("!---------------------------------")
+        output.AddLine("! Global configuration ({}) ".format(config_position))
+        output.AddLine("!---------------------------------")
+        for block in self.profile_list[device_name].get(config_position, ()):
+            output.AddBlock(block)
+
+    #------------------------------------------------------------------------------
+    # The text CreateGlobalConfig adds for a profile (config template or variable)
+    # only depends on the profile and the device's scope (see GetDeviceScope), so
+    # it's rendered once for each and the same string is added to every device.
+    # A scope that doesn't change the profile shares the global block
+    #------------------------------------------------------------------------------
+    def GetProfileBlock(self,profile_name,device_name):
+        scope = self.device_scopes.get(device_name, ())
+        if scope:
+            scope_lists = self.variable_scopes[scope]
+            if profile_name not in scope_lists["Config Templates"] and profile_name not in scope_lists["Variables"]:
+                scope = ()
+        key = (profile_name, scope)
+        if key not in self.profile_blocks:
+            lines = []
+            if self.GetConfigTemplate(profile_name,device_name):
+                lines.append("\n! [{}]:".format(profile_name))
+                for line in self.GetConfigTemplate(profile_name,device_name):
+                    lines.append("{}".format(line))
+            elif self.GetVariable(profile_name,device_name):
+                lines.append("\n! [{}]:".format(profile_name))
+                lines.append("{}".format(self.GetVariable(profile_name,device_name)))
+            self.profile_blocks[key] = "\n".join(lines)
+        return self.profile_blocks[key]
+
+    def CreateVlanConfig(self,output,device_name):
+        if not self.vlan_list.get(device_name):
             return
-        print ("!---------------------------------")
-        print ("! VLAN configuration ")
-        print ("!---------------------------------")
-        for vlan in sorted(vlan_list[device_name]):
-            print ("vlan {}".format(vlan))
-            print (" name {}".format(vlan_list[device_name].get(vlan)))
-
-    def CreateVrfConfig(self,device_name):
-        if not vrf_list.get(device_name):
+        output.AddLine("!---------------------------------")
+        output.AddLine("! VLAN configuration ")
+        output.AddLine("!---------------------------------")
+        for vlan in sorted(self.vlan_list[device_name]):
+            output.AddLine("vlan {}".format(vlan))
+            output.AddLine(" name {}".format(self.vlan_list[device_name].get(vlan)))
+
+    def CreateVrfConfig(self,output,device_name):
+        if not self.vrf_list.get(device_name):
             return
-        print ("!---------------------------------")
-        print ("! VRF configuration ")
-        print ("!---------------------------------")
-        for vrf in sorted(vrf_list[device_name]):
-            print ("ip vrf {}".format(vrf))
+        output.AddLine("!---------------------------------")
+        output.AddLine("! VRF configuration ")
+        output.AddLine("!---------------------------------")
+        for vrf in sorted(self.vrf_list[device_name]):
+            output.AddLine("ip vrf {}".format(vrf))
             if self.has_rd_configured(device_name,vrf):
-                print ("  rd {}".format(vrf_list[device_name][vrf]["RD"]))
+                output.AddLine("  rd {}".format(self.vrf_list[device_name][vrf]["RD"]))
             if self.has_importrt_configured(device_name,vrf):
-                for route_target in vrf_list[device_name][vrf]["Import RT  (separated by commas)"]:
-                    print ("  route-target import {}".format(route_target))
+                for route_target in self.vrf_list[device_name][vrf]["Import RT  (separated by commas)"]:
+                    output.AddLine("  route-target import {}".format(route_target))
             if self.has_exportrt_configured(device_name,vrf):
-                for route_target in vrf_list[device_name][vrf]["Export RT  (separated by commas)"]:
-                    print ("  route-target export {}".format(route_target))
-            if vrf_list[device_name][vrf]["Variable"]:
-                if self.is_valid_variable(vrf_list[device_name][vrf]["Variable"]):
-                    print (self.GetVariable(vrf_list[device_name][vrf]["Variable"]))
+                for route_target in self.vrf_list[device_name][vrf]["Export RT  (separated by commas)"]:
+                    output.AddLine("  route-target export {}".format(route_target))
+            if self.vrf_list[device_name][vrf]["Variable"]:
+                if self.is_valid_variable(self.vrf_list[device_name][vrf]["Variable"],device_name):
+                    output.AddLine(self.GetVariable(self.vrf_list[device_name][vrf]["Variable"],device_name))
 
 
-    def CreateStaticRouteConfig(self,device_name):
-        if not static_route_list.get(device_name):
+    def CreateStaticRouteConfig(self,output,device_name):
+        if not self.static_route_list.get(device_name):
             return
-        print ("!---------------------------------")
-        print ("! Static routing configuration ")
-        print ("!---------------------------------")
-        for route in sorted(static_route_list[device_name]):
-            route_vrf = static_route_list[device_name][route]["VRF (leave blank if global)"]
-            route_entry = static_route_list[device_name][route]["Route"]
-            route_subnet = static_route_list[device_name][route]["Subnet"]
-            route_nexthop = static_route_list[device_name][route]["Next Hop"]
-            route_name = static_route_list[device_name][route]["Route Name (no spaces)"]
+        output.AddLine("!---------------------------------")
+        output.AddLine("! Static routing configuration ")
+        output.AddLine("!---------------------------------")
+        for route in sorted(self.static_route_list[device_name]):
+            route_vrf = self.static_route_list[device_name][route]["VRF (leave blank if global)"]
+            route_entry = self.static_route_list[device_name][route]["Route"]
+            route_subnet = self.static_route_list[device_name][route]["Subnet"]
+            route_nexthop = self.static_route_list[device_name][route]["Next Hop"]
+            route_name = self.static_route_list[device_name][route]["Route Name (no spaces)"]
 
             if route_entry:
                 if route_vrf and route_subnet and route_nexthop and route_name:
-                    print ("ip route vrf {} {} {} name {}".format(route_vrf,route_entry,route_subnet,route_name))
+                    output.AddLine("ip route vrf {} {} {} name {}".format(route_vrf,route_entry,route_subnet,route_name))
                 elif route_vrf and route_subnet and route_nexthop:
-                    print ("ip route vrf {} {} {}".format(route_vrf,route_entry,route_subnet))
+                    output.AddLine("ip route vrf {} {} {}".format(route_vrf,route_entry,route_subnet))
                 elif route_subnet and route_nexthop and route_name:
-                    print ("ip route {} {} {} name {}".format(route_entry,route_subnet,route_nexthop,route_name))
+                    output.AddLine("ip route {} {} {} name {}".format(route_entry,route_subnet,route_nexthop,route_name))
                 elif route_subnet and route_nexthop:
-                    print ("ip route {} {} {}".format(route_entry,route_subnet,route_nexthop))
+                    output.AddLine("ip route {} {} {}".format(route_entry,route_subnet,route_nexthop))
 
-    def CreatePrefixConfig(self,device_name):
-        if not prefix_list.get(device_name):
+    def CreatePrefixConfig(self,output,device_name):
+        if not self.prefix_list.get(device_name):
             return
-        print ("!---------------------------------")
-        print ("! Prefix-list configuration ")
-        print ("!---------------------------------")
-
-        for prefix_name in sorted(prefix_list[device_name]):
-            oldlist = prefix_list[device_name][prefix_name]
-            newlist = sorted(oldlist, key=itemgetter('sequence'))
-            for entry in newlist:
+        output.AddLine("!---------------------------------")
+        output.AddLine("! Prefix-list configuration ")
+        output.AddLine("!---------------------------------")
+
+        for prefix_name in sorted(self.prefix_list[device_name]):
+            for entry in self.prefix_list[device_name][prefix_name]:
                 pl_sequence = entry["sequence"]
                 pl_action = entry["action"]
                 pl_entry = entry["entry"]
-                print ("ip prefix-list {} seq {} {} {}".format(prefix_name,pl_sequence,pl_action,pl_entry))
+                output.AddLine("ip prefix-list {} seq {} {} {}".format(prefix_name,pl_sequence,pl_action,pl_entry))
             else:
-                print ("!")
+                output.AddLine("!")
 
-    def CreateInterfaceConfig(self,device_name,config_mode):
-        if not interface_list.get(device_name):
+    def CreateInterfaceConfig(self,output,device_name,config_mode):
+        if not self.interface_list.get(device_name):
             return
         first_match = True
-        for interface in sorted(interface_list[device_name]):
+        for interface in sorted(self.interface_list[device_name]):
             if config_mode == "Physical":
                 if not self.GetInterfaceType(interface) == "Physical":
                     continue
@@ -734,160 +1872,371 @@ class Config(object):
                 if not self.GetInterfaceType(interface) == "Logical":
                     continue
             if (first_match and "Physical" in config_mode):
-                print ("!--------------------------------------------")
-                print ("! Interface configuration (Physical) ")
-                print ("!--------------------------------------------")
+                output.AddLine("!--------------------------------------------")
+                output.AddLine("! Interface configuration (Physical) ")
+                output.AddLine("!--------------------------------------------")
             elif (first_match and "Logical" in config_mode):
-                print ("!--------------------------------------------")
-                print ("! Interface configuration (Logical) ")
-                print ("!--------------------------------------------")
+                output.AddLine("!--------------------------------------------")
+                output.AddLine("! Interface configuration (Logical) ")
+                output.AddLine("!--------------------------------------------")
             first_match = False
 
             if self.is_portchannel_member(device_name,interface):
-                pc_type = interface_list[device_name][interface]["PC-Type"]
+                pc_type = self.interface_list[device_name][interface]["PC-Type"]
                 if "layer2" in pc_type:
-                    print ("!....................................")
-                    print ("!  Layer 2 PC: create physical first")
-                    print ("!....................................")
+                    output.AddLine("!....................................")
+                    output.AddLine("!  Layer 2 PC: create physical first")
+                    output.AddLine("!....................................")
                 elif "layer3" in pc_type:
-                    print ("!....................................")
-                    print ("!  Layer 3 PC: create logical first")
-                    print ("!....................................")
+                    output.AddLine("!....................................")
+                    output.AddLine("!  Layer 3 PC: create logical first")
+                    output.AddLine("!....................................")
             # ---------------------------------------------------
             # Start generating interface specific configuration
             # ---------------------------------------------------
-            print ("interface {}".format(interface_list[device_name][interface]["Interface"]))
+            output.AddLine("interface {}".format(self.interface_list[device_name][interface]["Interface"]))
 
             if self.is_portchannel_parent(device_name,interface):
-                pc_members = interface_list[device_name][interface]["PC-Members"]
-                print ("  !- pc members: {}".format(", ".join(pc_members)))
+                pc_members = self.interface_list[device_name][interface]["PC-Members"]
+                output.AddLine("  !- pc members: {}".format(", ".join(pc_members)))
             if self.is_switch_port(device_name,interface):
-                print ("  switchport")
+                output.AddLine("  switchport")
             if self.is_routed_port(device_name,interface):
-                print ("  no switchport")
+                output.AddLine("  no switchport")
             if self.has_description_configured(device_name,interface):
-                print ("  description {}".format(interface_list[device_name][interface]["Description"]))
+                output.AddLine("  description {}".format(self.interface_list[device_name][interface]["Description"]))
             if self.has_mtu_configured(device_name,interface):
-                print ("  mtu {}".format(interface_list[device_name][interface]["MTU"]))
+                output.AddLine("  mtu {}".format(self.interface_list[device_name][interface]["MTU"]))
             if self.has_vrf_configured(device_name,interface):
-                print ("  ip vrf forwarding {}".format(interface_list[device_name][interface]["VRF (leave blank if global)"]))
+                output.AddLine("  ip vrf forwarding {}".format(self.interface_list[device_name][interface]["VRF (leave blank if global)"]))
             if self.has_ip_configured(device_name,interface):
-                print ("  ip address {}".format(self.GetIP(interface_list[device_name][interface]["IP Address (x.x.x.x/x)"])))
+                output.AddLine("  ip address {}".format(self.GetIP(self.interface_list[device_name][interface]["IP Address (x.x.x.x/x)"])))
             if self.is_trunk_port(device_name,interface):
-                trunk_vlans = interface_list[device_name][interface]["Trunk Allowed VLANs (separated by commas)"]
-                print ("  switchport mode trunk")
-                print ("  switchport trunk allowed vlan {}".format(trunk_vlans))
+                trunk_vlans = self.GetTrunkVlans(device_name,interface)
+                if not trunk_vlans:
+                    trunk_vlans = self.interface_list[device_name][interface]["Trunk Allowed VLANs (separated by commas)"]
+                output.AddLine("  switchport mode trunk")
+                output.AddLine("  switchport trunk allowed vlan {}".format(trunk_vlans))
             if self.has_nativevlan_configured(device_name,interface):
-                native_vlan = interface_list[device_name][interface]["Trunk Native VLAN"]
-                print ("  switchport trunk native vlan {}".format(native_vlan))
+                native_vlan = self.interface_list[device_name][interface]["Trunk Native VLAN"]
+                output.AddLine("  switchport trunk native vlan {}".format(native_vlan))
             if self.is_data_port(device_name,interface):
-                print ("  switchport access vlan {}".format(interface_list[device_name][interface]["Data VLAN"]))
+                output.AddLine("  switchport access vlan {}".format(self.interface_list[device_name][interface]["Data VLAN"]))
             if self.is_voice_port(device_name,interface):
-                print ("  switchport voice vlan {}".format(interface_list[device_name][interface]["Voice VLAN"]))
+                output.AddLine("  switchport voice vlan {}".format(self.interface_list[device_name][interface]["Voice VLAN"]))
             if self.is_portchannel_member(device_name,interface):
-                pc_group = interface_list[device_name][interface]["PC-Group"]
-                pc_mode = interface_list[device_name][interface]["PC-Mode"]
-                print ("  channel-group {} mode {}".format(pc_group,pc_mode))
+                pc_group = self.interface_list[device_name][interface]["PC-Group"]
+                pc_mode = self.interface_list[device_name][interface]["PC-Mode"]
+                output.AddLine("  channel-group {} mode {}".format(pc_group,pc_mode))
             if self.has_variable1_configured(device_name,interface):
-                if self.is_valid_variable(interface_list[device_name][interface]["Variable 1"]):
-                    print (self.GetVariable(interface_list[device_name][interface]["Variable 1"]))
+                if self.is_valid_variable(self.interface_list[device_name][interface]["Variable 1"],device_name):
+                    output.AddLine(self.GetVariable(self.interface_list[device_name][interface]["Variable 1"],device_name))
             if self.has_variable2_configured(device_name,interface):
-                if self.is_valid_variable(interface_list[device_name][interface]["Variable 2"]):
-                    print (self.GetVariable(interface_list[device_name][interface]["Variable 2"]))
+                if self.is_valid_variable(self.interface_list[device_name][interface]["Variable 2"],device_name):
+                    output.AddLine(self.GetVariable(self.interface_list[device_name][interface]["Variable 2"],device_name))
             if self.has_speed_configured(device_name,interface):
-                print ("  speed {}".format(interface_list[device_name][interface]["Speed"]))
+                output.AddLine("  speed {}".format(self.interface_list[device_name][interface]["Speed"]))
             if self.has_duplex_configured(device_name,interface):
-                print ("  duplex {}".format(interface_list[device_name][interface]["Duplex"]))
+                output.AddLine("  duplex {}".format(self.interface_list[device_name][interface]["Duplex"]))
             if self.is_interface_enabled(device_name,interface):
-                print ("  no shutdown")
+                output.AddLine("  no shutdown")
             else:
-                print ("  shutdown")
+                output.AddLine("  shutdown")
         else:
-            print ("!")
+            output.AddLine("!")
 
 
-    def GenerateConfig(self):
-        global device_list
-        console = sys.__stdout__
+    def GenerateConfig(self,jobs=1,devices=None):
+        if devices is None:
+            devices = self.device_list
         print ("Generating configuration....")
-        for device in device_list:
-            sys.stdout = Logger(device+".txt")
-            print ("****************************************")
-            print ("! Device configuration for {}".format(device))
-            print ("****************************************")
-            self.CreateGlobalConfig(device,"Start")
-            self.CreateVrfConfig(device)
-            self.CreateVlanConfig(device)
-            self.CreateInterfaceConfig(device,"Physical")
-            self.CreateInterfaceConfig(device,"Logical")
-            self.CreatePrefixConfig(device)
-            self.CreateStaticRouteConfig(device)
-            self.CreateGlobalConfig(device,"End")
-            sys.stdout = console
+        if jobs > 1 and len(devices) > 1:
+            #---------------------------------------------------------------
+            # Render the devices across a process pool. imap() returns the
+            # configs in device_list order so the files are written (and
+            # the progress shown) in the same order as a serial run
+            #---------------------------------------------------------------
+            chunk_size = max(1, len(devices) // (jobs * 4))
+            pool = multiprocessing.Pool(jobs, InitRenderWorker, (self.GetRenderModel(),))
+            try:
+                configs = pool.imap(RenderDevice, devices, chunk_size)
+                for device, output in zip(devices, configs):
+                    output.WriteFile(device+".txt")
+                    print ("- {} configuration generated.".format(device))
+            finally:
+                pool.close()
+                pool.join()
+            return
+        for device in devices:
+            self.CreateDeviceConfig(device).WriteFile(device+".txt")
             print ("- {} configuration generated.".format(device))
 
+    #------------------------------------------------------------------
+    # Yield (device, config text) for each device as soon as it has been
+    # generated, so only one device's config is held at a time
+    #------------------------------------------------------------------
+    def IterDeviceConfigs(self):
+        for device in self.device_list:
+            yield device, self.CreateDeviceConfig(device).GetText()
+
+    #---------------------------------------------------------------------------
+    # Incremental mode (--incremental). ccg-manifest.json keeps a fingerprint of
+    # everything each device's config is generated from: its rows in every
+    # worksheet plus the variables/templates its profiles, VRFs and interfaces
+    # ("Variable 1/2") refer to, along with the interface errors found for it
+    # and a sha256 of the file written for it ("Output").
+    # A device whose fingerprint hasn't changed, and whose file is still the
+    # one written for it, keeps the errors from the manifest and isn't checked
+    # or generated again. The file is checked as normal and --stream runs (or
+    # anything else) can write over it without the manifest being updated.
+    # MANIFEST_VERSION needs to go up whenever the generated config or what is
+    # kept in the manifest changes.
+    #---------------------------------------------------------------------------
+    MANIFEST_VERSION = 3
+
+    def GetDeviceFingerprint(self,device):
+        inputs = []
+        for worksheet in self.worksheet_list:
+            rows = self.GetDeviceRows(device,worksheet)
+            if rows:
+                inputs.append((worksheet, self.column_list[worksheet], [row.values for row in rows]))
+        names = set()
+        for row in self.GetDeviceRows(device,"profiles"):
+            names.add(row.get("Template or Variable"))
+        for row in self.GetDeviceRows(device,"vrf"):
+            names.add(row.get("Variable"))
+        for row in self.GetDeviceRows(device,"interfaces"):
+            names.add(row.get("Variable 1"))
+            names.add(row.get("Variable 2"))
+        for name in sorted(names, key=str):
+            if name:
+                inputs.append((name, self.GetConfigTemplate(name,device), self.GetVariable(name,device)))
+        return hashlib.sha256(repr(inputs).encode("utf-8")).hexdigest()
+
+    def GetManifestVersion(self):
+        return "{} {}".format(__version__, self.MANIFEST_VERSION)
+
+    #------------------------------------------------------------------------
+    # Compare the devices against the last manifest, check the interfaces of
+    # the ones that changed and put the stored errors back for the rest.
+    # Returns the devices that need generating and the new manifest, whose
+    # "Output" for each of those is filled in once it has been generated
+    #------------------------------------------------------------------------
+    def CheckChangedDevices(self,manifest):
+        last_devices = {}
+        if manifest.get("Version") == self.GetManifestVersion():
+            last_devices = manifest.get("Devices", {})
+        devices = {}
+        changed_devices = []
+        for device in self.device_list:
+            fingerprint = self.GetDeviceFingerprint(device)
+            entry = last_devices.get(device)
+            if entry and entry["Fingerprint"] == fingerprint and entry["Output"] == GetFileHash(device+".txt"):
+                devices[device] = entry
+            else:
+                devices[device] = {"Fingerprint": fingerprint, "Interface Errors": [], "Output": None}
+                changed_devices.append(device)
+        changed = set(changed_devices)
+        for device in self.GetInterfaceDevices():
+            if device in changed:
+                first_error = len(self.error_db["interfaces"])
+                self.CheckDeviceInterfacesForErrors(device)
+                devices[device]["Interface Errors"] = self.error_db["interfaces"][first_error:]
+            else:
+                self.error_db["interfaces"].extend(devices[device]["Interface Errors"])
+        return changed_devices, {"Version": self.GetManifestVersion(), "Devices": devices}
+
+    #--------------------------------------------------------------------
+    # Everything read from the workbook by CreateRawDb and cleaned up by
+    # RemoveEmptyRowsFromDB, i.e. what BuildCache keeps for a workbook.
+    # It's only plain data, so it can be read back by any copy of this
+    # module (run as a script it's __main__, otherwise it's imported):
+    # each raw_db row is kept as its values and device_db is left out.
+    # SetRawDbState makes the RowRecords and groups them by device again
+    #--------------------------------------------------------------------
+    def GetRawDbState(self):
+        raw_db_names = ("error_db", "worksheet_list", "column_list", "column_index",
+                        "ingest_stats", "ignored_rows", "required_columns", "required_positions")
+        state = {name: getattr(self, name) for name in raw_db_names}
+        state["raw_db"] = {worksheet_name: [row.values for row in rows] for worksheet_name, rows in self.raw_db.items()}
+        return state
+
+    def SetRawDbState(self,state):
+        self.__dict__.update(state)
+        self.raw_db = {}
+        self.device_db = {}
+        for worksheet_name, rows in state["raw_db"].items():
+            columns = self.column_index[worksheet_name]
+            self.raw_db[worksheet_name] = [RowRecord(columns, values) for values in rows]
+            if "Device Name" in columns:
+                for record in self.raw_db[worksheet_name]:
+                    self.AddToDeviceDb(worksheet_name,record)
+
+    def GetRenderModel(self):
+        render_model_names = ("config_templates", "variable_list", "variable_scopes", "device_scopes", "profile_list",
+                              "vlan_list", "vlan_bitmaps", "vrf_list", "interface_list", "static_route_list", "prefix_list", "portchannel_list")
+        return {name: getattr(self, name) for name in render_model_names}
+
+    def CreateDeviceConfig(self,device):
+        output = OutputBuffer()
+        output.AddLine("****************************************")
+        output.AddLine("! Device configuration for {}".format(device))
+        output.AddLine("****************************************")
+        self.CreateGlobalConfig(output,device,"Start")
+        self.CreateVrfConfig(output,device)
+        self.CreateVlanConfig(output,device)
+        self.CreateInterfaceConfig(output,device,"Physical")
+        self.CreateInterfaceConfig(output,device,"Logical")
+        self.CreatePrefixConfig(output,device)
+        self.CreateStaticRouteConfig(output,device)
+        self.CreateGlobalConfig(output,device,"End")
+        return output
+
     def CheckInterfacesForErrors(self):
-        for device in interface_list:
-            for interface in sorted(interface_list[device]):
-                if self.is_routed_port(device,interface) and self.is_switch_port(device,interface):
-                    error_db["interfaces"].append("Row ({}): [{}] [{}] both routed and switchport config detected".format(interface_list[device][interface]["Row"],device,interface))
-                if self.has_variable1_configured(device,interface):
-                    if not self.GetVariable(interface_list[device][interface]["Variable 1"]):
-                        error_db["interfaces"].append("Row ({}): [{}] [{}] referenced variable '{}' which does not exist".format(interface_list[device][interface]["Row"],device,interface,interface_list[device][interface]["Variable 1"]))
-                if self.has_variable2_configured(device,interface):
-                    if not self.GetVariable(interface_list[device][interface]["Variable 2"]):
-                        error_db["interfaces"].append("Row ({}): [{}] [{}] referenced variable '{}' which does not exist".format(interface_list[device][interface]["Row"],device,interface,interface_list[device][interface]["Variable 2"]))
-                if self.is_data_port(device,interface):
-                    if not self.is_valid_vlan(device,interface_list[device][interface]["Data VLAN"]):
-                        error_db["interfaces"].append("Row ({}): [{}] [{}] referenced Data VLAN '{}' which does not exist".format(interface_list[device][interface]["Row"],device,interface,interface_list[device][interface]["Data VLAN"]))
-                if self.is_voice_port(device,interface):
-                    if not self.is_valid_vlan(device,interface_list[device][interface]["Voice VLAN"]):
-                        error_db["interfaces"].append("Row ({}): [{}] [{}] referenced Voice VLAN '{}' which does not exist".format(interface_list[device][interface]["Row"],device,interface,interface_list[device][interface]["Data VLAN"]))
-                if self.has_nativevlan_configured(device,interface):
-                    if not self.is_valid_vlan(device,interface_list[device][interface]["Trunk Native VLAN"]):
-                        error_db["interfaces"].append("Row ({}): [{}] [{}] referenced Native VLAN '{}' which does not exist".format(interface_list[device][interface]["Row"],device,interface,interface_list[device][interface]["Trunk Native VLAN"]))
-                if self.has_vrf_configured(device,interface):
-                    if not self.is_valid_vrf(device,interface_list[device][interface]["VRF (leave blank if global)"]):
-                        error_db["interfaces"].append("Row ({}): [{}] [{}] referenced vrf '{}' which does not exist".format(interface_list[device][interface]["Row"],device,interface,interface_list[device][interface]["VRF (leave blank if global)"]))
-                if self.has_ip_configured(device,interface):
-                    if not self.is_valid_ipaddress(interface_list[device][interface]["IP Address (x.x.x.x/x)"]):
-                        error_db["interfaces"].append("Row ({}): [{}] [{}] using IPAddr '{}' which is invalid".format(interface_list[device][interface]["Row"],device,interface,interface_list[device][interface]["IP Address (x.x.x.x/x)"]))
-                if self.is_trunk_port(device,interface):
-                    if not self.is_valid_trunk(device,interface):
-                        error_db["interfaces"].append("Row ({}): [{}] [{}] one or more vlans referenced in trunk do not exist".format(interface_list[device][interface]["Row"],device,interface))
+        for device in self.GetInterfaceDevices():
+            self.CheckDeviceInterfacesForErrors(device)
+
+    #-------------------------------------------------------------------------
+    # The devices in interface_list in the order they first appear in the
+    # "interfaces" worksheet (then "portchannels"), i.e. the order the errors
+    # for each device are listed in ccg-errors.txt
+    #-------------------------------------------------------------------------
+    def GetInterfaceDevices(self):
+        return sorted(self.interface_list, key=self.GetInterfaceErrorOrder)
+
+    def GetInterfaceErrorOrder(self,device):
+        for rank, worksheet in enumerate(("interfaces", "portchannels")):
+            rows = self.GetDeviceRows(device,worksheet)
+            if rows:
+                return (rank, rows[0]["Row"])
+        return (2, 0)
+
+    def AddInterfaceError(self,device,interface,message):
+        self.error_db["interfaces"].append(self.GetErrorRecord("interfaces",self.interface_list[device][interface]["Row"],
+                                                               device,interface,message))
+
+    def CheckDeviceInterfacesForErrors(self,device):
+        for interface in sorted(self.interface_list[device]):
+            if self.is_routed_port(device,interface) and self.is_switch_port(device,interface):
+                self.AddInterfaceError(device,interface,"both routed and switchport config detected")
+            if self.has_variable1_configured(device,interface):
+                if not self.GetVariable(self.interface_list[device][interface]["Variable 1"],device):
+                    self.AddInterfaceError(device,interface,"referenced variable '{}' which does not exist".format(self.interface_list[device][interface]["Variable 1"]))
+            if self.has_variable2_configured(device,interface):
+                if not self.GetVariable(self.interface_list[device][interface]["Variable 2"],device):
+                    self.AddInterfaceError(device,interface,"referenced variable '{}' which does not exist".format(self.interface_list[device][interface]["Variable 2"]))
+            if self.is_data_port(device,interface):
+                if not self.is_valid_vlan(device,self.interface_list[device][interface]["Data VLAN"]):
+                    self.AddInterfaceError(device,interface,"referenced Data VLAN '{}' which does not exist".format(self.interface_list[device][interface]["Data VLAN"]))
+            if self.is_voice_port(device,interface):
+                if not self.is_valid_vlan(device,self.interface_list[device][interface]["Voice VLAN"]):
+                    self.AddInterfaceError(device,interface,"referenced Voice VLAN '{}' which does not exist".format(self.interface_list[device][interface]["Data VLAN"]))
+            if self.has_nativevlan_configured(device,interface):
+                if not self.is_valid_vlan(device,self.interface_list[device][interface]["Trunk Native VLAN"]):
+                    self.AddInterfaceError(device,interface,"referenced Native VLAN '{}' which does not exist".format(self.interface_list[device][interface]["Trunk Native VLAN"]))
+            if self.has_vrf_configured(device,interface):
+                if not self.is_valid_vrf(device,self.interface_list[device][interface]["VRF (leave blank if global)"]):
+                    self.AddInterfaceError(device,interface,"referenced vrf '{}' which does not exist".format(self.interface_list[device][interface]["VRF (leave blank if global)"]))
+            if self.has_ip_configured(device,interface):
+                if not self.is_valid_ipaddress(self.interface_list[device][interface]["IP Address (x.x.x.x/x)"]):
+                    self.AddInterfaceError(device,interface,"using IPAddr '{}' which is invalid".format(self.interface_list[device][interface]["IP Address (x.x.x.x/x)"]))
+            if self.is_trunk_port(device,interface):
+                if not self.is_valid_trunk(device,interface):
+                    self.AddInterfaceError(device,interface,"one or more vlans referenced in trunk do not exist")
+
+    #-------------------------------------------------------------------------
+    # Each error is a record, the same as ignored_rows, so GenerateConfigs()
+    # can hand them over without them being parsed back out of the text:
+    #   "Worksheet" - the worksheet the error is listed under
+    #   "Row"       - the row it was found on (None for a config template
+    #                 line, which isn't kept with its row number)
+    #   "Device"    - the device it was found for (None for a variable or
+    #                 config template)
+    #   "Name"      - the interface, variable or config template
+    #   "Message"   - what is wrong, e.g. "referenced vrf 'X' which does
+    #                 not exist"
+    #   "Scope"     - the scope of a variable/config template error that only
+    #                 happens for some devices (see GetDeviceScope), or None
+    # FormatError() gives the line written to ccg-errors.txt
+    #-------------------------------------------------------------------------
+    ERROR_WORKSHEETS = ("profiles", "variables", "config-templates", "interfaces")
+
+    def GetErrorRecord(self,worksheet,row,device,name,message):
+        return {"Worksheet":worksheet,"Row":row,"Device":device,"Name":name,"Message":message,"Scope":None}
+
+    def FormatError(self,record):
+        if record["Worksheet"] == "interfaces":
+            text = "Row ({Row}): [{Device}] [{Name}] {Message}"
+        elif record["Worksheet"] == "profiles":
+            text = "Row ({Row}): Device '{Device}' {Message}"
+        elif record["Worksheet"] == "variables":
+            text = "Row ({Row}): Variable '{Name}' {Message}"
+        elif record["Row"] is None:
+            text = "Config-Template: '{Name}' {Message}"
+        else:
+            text = "Row ({Row}): Config-Template '{Name}' {Message}"
+        text = text.format(**record)
+        if record["Scope"]:
+            text += " (scope: {})".format(" > ".join(record["Scope"]))
+        return text
+
+    # All of the errors in the order they are listed in ccg-errors.txt
+    def GetErrors(self):
+        return [entry for worksheet in self.ERROR_WORKSHEETS for entry in self.error_db.get(worksheet, [])]
+
+    def CreateErrorReport(self):
+        output = OutputBuffer()
+        for worksheet in self.ERROR_WORKSHEETS:
+            if self.error_db.get(worksheet):
+                output.AddLine("===========================")
+                output.AddLine("Worksheet: [{}]".format(worksheet))
+                output.AddLine("===========================")
+                for entry in self.error_db[worksheet]:
+                    output.AddLine(self.FormatError(entry))
+        return output
 
     def GenerateErrorReport(self):
-        console = sys.__stdout__
-        sys.stdout = Logger("ccg-errors.txt")
-
-        if error_db["profiles"]:
-            print ("===========================")
-            print ("Worksheet: [profiles]")
-            print ("===========================")
-            for entry in error_db["profiles"]:
-                print (entry)
-
-        if error_db["config-templates"]:
-            print ("===========================")
-            print ("Worksheet: [config-templates]")
-            print ("===========================")
-            for entry in error_db["config-templates"]:
-                print (entry)
-
-        if error_db["interfaces"]:
-            print ("===========================")
-            print ("Worksheet: [interfaces]")
-            print ("===========================")
-            for entry in error_db["interfaces"]:
-                print (entry)
-        sys.stdout = console
-
-def StartCode():
+        self.CreateErrorReport().WriteFile("ccg-errors.txt")
+
+#------------------------------------------------------------------------------
+# Parallel rendering (--jobs). Rendering only reads the lists built by the
+# Get<whatever>List functions (see Config.GetRenderModel), so these are sent
+# to each worker process once when the pool starts rather than with every
+# device. Each worker keeps its own Config in render_config.
+#------------------------------------------------------------------------------
+render_config = None
+
+def InitRenderWorker(model):
+    global render_config
+    render_config = Config(None)
+    render_config.__dict__.update(model)
+
+def RenderDevice(device):
+    return render_config.CreateDeviceConfig(device)
+
+#------------------------------------------------------------------------------
+# Read the build spreadsheet into a Config that is ready to generate configs
+#------------------------------------------------------------------------------
+# With a BuildCache the raw database is loaded from the cache if the workbook
+# has been read before, and saved to it otherwise. check_errors=False leaves
+# the interface checks to the caller (see Config.CheckChangedDevices)
+#------------------------------------------------------------------------------
+def ReadBuild(workbook,cache=None,check_errors=True):
     #--------------------------------------------------------------------------------------------------------
     # Execute the code
     #--------------------------------------------------------------------------------------------------------
-    db = Config()               # Read the build spreadsheet and build the raw database
-    db.RemoveEmptyRowsFromDB()  # Clean up the database and remove rows that don't have required columns
+    db = None
+    if cache is not None:
+        cache_key = cache.GetKey(workbook.source)
+        state = cache.Load(cache_key)
+        if state is not None:
+            db = Config(None)
+            db.SetRawDbState(state)
+    if db is None:
+        db = Config(workbook)       # Read the build spreadsheet and build the raw database
+        db.RemoveEmptyRowsFromDB()  # Clean up the database and remove rows that don't have required columns
+        if cache is not None:
+            cache.Save(cache_key,db.GetRawDbState())
     #--------------------------------------------------------------------------------------------------------
     db.GetDeviceList()          # Scan through all the worksheets and capture a list of unique devices names
     db.GetVlanList()            # Scan through the vlan worksheet and capture a list of vlans per device
@@ -900,15 +2249,137 @@ def StartCode():
     db.GetPrefixList()          # Scan through the "prefix-list" worksheet and capture prefix-lists
     db.GetPortChannelList()     # Scan through the "portchannels" worksheet and capture all the portchannels
     #--------------------------------------------------------------------------------------------------------
-    db.CheckInterfacesForErrors()
+    if check_errors:
+        db.CheckInterfacesForErrors()
+    return db
+
+def StartCode(workbook,jobs=1,stream=False,spill_rows=0,cache=None,incremental=False):
+    if stream or spill_rows:
+        if StreamCode(workbook,spill_rows):
+            return
+        print ("Worksheets are not sorted by device name, reading the whole workbook instead.")
+    db = ReadBuild(workbook,cache,not incremental)
+    db.GenerateIgnoredReport()
     #--------------------------------------------------------------------------------------------------------
-    db.GenerateConfig()         # Generate the actual configuration
+    if incremental:
+        changed_devices, manifest = db.CheckChangedDevices(ReadManifest("ccg-manifest.json"))
+        print ("{} of {} devices have changed.".format(len(changed_devices),len(db.device_list)))
+        db.GenerateConfig(jobs,changed_devices)
+        for device in changed_devices:
+            manifest["Devices"][device]["Output"] = GetFileHash(device+".txt")
+        WriteManifest("ccg-manifest.json",manifest)
+    else:
+        db.GenerateConfig(jobs)     # Generate the actual configuration
     db.GenerateErrorReport()
     #--------------------------------------------------------------------------------------------------------
     print ("\nConfiguration has been generated.")
 
-#filename = "build-v2.0.xlsx"
-#StartCode()
+#---------------------------------------------------------------------
+# Read/write the --incremental manifest (an empty one if there isn't
+# one yet or it can't be read)
+#---------------------------------------------------------------------
+def ReadManifest(filename):
+    try:
+        with open(filename) as manifest_file:
+            return json.load(manifest_file)
+    except (IOError, ValueError):
+        return {}
+
+def WriteManifest(filename,manifest):
+    with open(filename, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+
+# sha256 of a generated file (None if it isn't there)
+def GetFileHash(filename):
+    try:
+        with open(filename, "rb") as input_file:
+            return hashlib.sha256(input_file.read()).hexdigest()
+    except (IOError, OSError):
+        return None
+
+#------------------------------------------------------------------------------
+# Same as StartCode() but each device is read, checked and generated before the
+# next one (see Config.IterSortedDevices). The reports are written at the end.
+# The sort order is checked as the workbook is read. If a worksheet turns out
+# not to be sorted, the files written so far can't be trusted: with spill_rows
+# the workbook is read again with that worksheet sorted on disk (so every
+# file is written again), otherwise False is returned for the caller to read
+# the whole workbook instead.
+#------------------------------------------------------------------------------
+def StreamCode(workbook,spill_rows=0):
+    print ("Generating configuration....")
+    spill_worksheets = []
+    while True:
+        db = Config(workbook,stream=True)
+        for device in db.IterSortedDevices(spill_worksheets,spill_rows):
+            db.CreateDeviceConfig(device).WriteFile(device+".txt")
+            print ("- {} configuration generated.".format(device))
+        if not db.unsorted_worksheets:
+            break
+        if not spill_rows:
+            return False
+        spill_worksheets.extend(db.unsorted_worksheets)
+        print ("Not sorted by device name, sorting on disk and starting again: {}".format(", ".join(db.unsorted_worksheets)))
+    db.GenerateIgnoredReport()
+    db.GenerateErrorReport()
+    print ("\nConfiguration has been generated.")
+    return True
+
+#------------------------------------------------------------------------------
+# Library entry point: generate the configs without writing any files, e.g.
+#   build = GenerateConfigs("build-v2.3.xlsx")
+#   build["Configs"]["Switch-1"]  -> text that would be in Switch-1.txt
+# workbook_file can be a filename, the workbook contents (bytes) or a file-like
+# object. Returns a dictionary with:
+#   "Configs" - config text for each device (in device order)
+#   "Errors"  - the errors in ccg-errors.txt: {"Worksheet", "Row", "Device",
+#               "Name", "Message", "Scope"} (see Config.GetErrorRecord)
+#   "Ignored" - rows removed for missing a required column: {"Worksheet",
+#               "Row", "Column"} (as in ccg-ignored.txt)
+# cache is an optional BuildCache (see ReadBuild).
+#------------------------------------------------------------------------------
+def GenerateConfigs(workbook_file,cache=None):
+    workbook = OpenWorkbook(workbook_file)
+    try:
+        db = ReadBuild(workbook,cache)
+    finally:
+        workbook.Close()
+    configs = OrderedDict(db.IterDeviceConfigs())
+    return {"Configs": configs, "Errors": db.GetErrors(), "Ignored": list(db.ignored_rows)}
+
+#------------------------------------------------------------------------------
+# Same as GenerateConfigs() but yields (device, config text) one device at a
+# time, e.g.
+#   for device, config in IterConfigs("build-v2.3.xlsx"):
+#       ...
+# The workbook is read when the first device is asked for. For the errors as
+# well, use ReadBuild() then IterDeviceConfigs() and GetErrors() on the Config.
+# With stream=True a workbook sorted by device name is read one device at a
+# time (see Config.IterSortedDevices), otherwise it's read in full as normal.
+# With spill_rows worksheets that aren't sorted are sorted on disk, spill_rows
+# rows at a time, and the workbook is always read one device at a time.
+# Configs that have been yielded can't be taken back, so the sort order is
+# checked before the first one with GetUnsortedWorksheets() (an extra pass
+# over the device worksheets), rather than as the workbook is read.
+#------------------------------------------------------------------------------
+def IterConfigs(workbook_file,stream=False,spill_rows=0,cache=None):
+    workbook = OpenWorkbook(workbook_file)
+    try:
+        if stream or spill_rows:
+            db = Config(workbook,stream=True)
+            unsorted_worksheets = db.GetUnsortedWorksheets()
+            if not unsorted_worksheets or spill_rows:
+                for device in db.IterSortedDevices(unsorted_worksheets,spill_rows):
+                    yield device, db.CreateDeviceConfig(device).GetText()
+                return
+        db = ReadBuild(workbook,cache)
+    finally:
+        workbook.Close()
+    for device, config in db.IterDeviceConfigs():
+        yield device, config
+
+#filename = "build-v2.3.xlsx"
+#StartCode(OpenWorkbook(filename))
 
 #---------------
 # Show the menu
@@ -919,18 +2390,61 @@ def main(argv):
         print ("============================================================")
         print ("Cisco Config Generator %s"%__version__)
         print ("============================================================")
-        print ("Usage: %s <filename.xls>"%sys.argv[0])
+        print ("Usage: %s <filename.xls> [--jobs N | --stream | --spill ROWS] [--cache DIR [--cache-size MB]] [--incremental]"%sys.argv[0])
+        exit()
+    filename = sys.argv[1]
+    jobs = 1
+    if "--jobs" in sys.argv:
+        try:
+            jobs = int(sys.argv[sys.argv.index("--jobs")+1])
+        except (IndexError, ValueError):
+            jobs = 0
+        if jobs < 1:
+            print ("--jobs needs a number of processes (1 or more)")
+            print ("Program aborted.")
+            exit()
+    spill_rows = 0
+    if "--spill" in sys.argv:
+        try:
+            spill_rows = int(sys.argv[sys.argv.index("--spill")+1])
+        except (IndexError, ValueError):
+            spill_rows = 0
+        if spill_rows < 1:
+            print ("--spill needs the number of rows to sort in memory at a time (1 or more)")
+            print ("Program aborted.")
+            exit()
+    stream = "--stream" in sys.argv
+    if (stream or spill_rows) and jobs > 1:
+        print ("--stream/--spill and --jobs can't be used together")
+        print ("Program aborted.")
         exit()
-    if sys.argv[1]:
-        global filename
-        filename = sys.argv[1]
+    incremental = "--incremental" in sys.argv
+    if (stream or spill_rows) and incremental:
+        print ("--stream/--spill and --incremental can't be used together")
+        print ("Program aborted.")
+        exit()
+    cache = None
+    if "--cache" in sys.argv:
+        try:
+            cache_dir = sys.argv[sys.argv.index("--cache")+1]
+            cache_size = 512
+            if "--cache-size" in sys.argv:
+                cache_size = int(sys.argv[sys.argv.index("--cache-size")+1])
+        except (IndexError, ValueError):
+            print ("--cache needs a directory (and --cache-size a number of MB)")
+            print ("Program aborted.")
+            exit()
+        cache = BuildCache(cache_dir, cache_size * 1048576)
     try:
-        workbook = xlrd.open_workbook(filename)
-        StartCode()
+        workbook = OpenWorkbook(filename)
     except IOError:
         print ("Unable to open: %s"% sys.argv[1])
         print ("Program aborted.")
         exit()
+    try:
+        StartCode(workbook,jobs,stream,spill_rows,cache,incremental)
+    finally:
+        workbook.Close()
 
 if __name__ == '__main__':
     main(sys.argv)
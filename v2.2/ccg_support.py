@@ -0,0 +1,237 @@
+import os
+import sys
+import random
+import zipfile
+import subprocess
+import importlib.util
+from xml.sax.saxutils import escape
+
+__author__ = 'Abdul Karim El-Assaad'
+
+#-----------------------------------------------------------------------
+# Shared by ccg-bench.py and the test_*.py files: loading ccg-v2.2.py as
+# a module, writing generated .xlsx workbooks, generating the sheets of
+# a whole build workbook and running ccg-v2.2.py on one
+# Run the tests with: python -m unittest discover v2.2
+#-----------------------------------------------------------------------
+
+#------------------------------------------------------------------
+# ccg-v2.2.py can't be imported by name because of the "-" and "."
+# It's only loaded once, so every caller gets the same module
+#------------------------------------------------------------------
+ccg_module = None
+
+def LoadCcg():
+    global ccg_module
+    if ccg_module is None:
+        spec = importlib.util.spec_from_file_location("ccg", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ccg-v2.2.py"))
+        ccg_module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(ccg_module)
+    return ccg_module
+
+#------------------------------------------------------------------------------
+# Write a minimal .xlsx. sheets is {sheet name: rows} (in workbook order) and
+# each row is a list of cell values, the first row being row 1:
+#   str             - with shared_strings, every other one goes in the shared
+#                     string table (the last one split into rich text runs)
+#                     and the rest are inline strings
+#   int/float       - number
+#   bool            - boolean
+#   ""              - no cell at all
+#   None            - a cell that only has formatting
+#   EMPTY_STRING    - a shared string that's empty
+# An empty row isn't written at all (the same as a row Excel has no cells for)
+#------------------------------------------------------------------------------
+EMPTY_STRING = object()
+
+def GetColumnLetters(column):
+    letters = ""
+    column += 1
+    while column:
+        column, remainder = divmod(column - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def WriteWorkbook(filename, sheets, shared_strings=True):
+    strings = []
+
+    def xml_cell(reference, value):
+        if value is None:
+            return '<c r="{}" s="1"/>'.format(reference)
+        if value is EMPTY_STRING:
+            strings.append("")
+            return '<c r="{}" t="s"><v>{}</v></c>'.format(reference, len(strings) - 1)
+        if isinstance(value, bool):
+            return '<c r="{}" t="b"><v>{}</v></c>'.format(reference, int(value))
+        if isinstance(value, str):
+            if not shared_strings or len(strings) % 2:
+                return '<c r="{}" t="inlineStr"><is><t xml:space="preserve">{}</t></is></c>'.format(reference, escape(value))
+            strings.append(value)
+            return '<c r="{}" t="s"><v>{}</v></c>'.format(reference, len(strings) - 1)
+        return '<c r="{}"><v>{}</v></c>'.format(reference, value)
+
+    def xml_row(row_no, values):
+        cells = []
+        for column, value in enumerate(values):
+            if isinstance(value, str) and value == "":
+                continue
+            cells.append(xml_cell("{}{}".format(GetColumnLetters(column), row_no), value))
+        return '<row r="{}">{}</row>'.format(row_no, "".join(cells))
+
+    with zipfile.ZipFile(filename, "w", zipfile.ZIP_DEFLATED) as archive:
+        overrides = "".join('<Override PartName="/xl/worksheets/sheet{}.xml" '
+                            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'.format(sheet_no)
+                            for sheet_no in range(1, len(sheets) + 1))
+        archive.writestr("[Content_Types].xml",
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+            '{}</Types>'.format(overrides))
+        archive.writestr("_rels/.rels",
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+            '</Relationships>')
+        archive.writestr("xl/workbook.xml",
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>{}</sheets></workbook>'.format(
+                "".join('<sheet name="{}" sheetId="{}" r:id="rId{}"/>'.format(escape(name), sheet_no, sheet_no)
+                        for sheet_no, name in enumerate(sheets, 1))))
+        archive.writestr("xl/_rels/workbook.xml.rels",
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">{}'
+            '<Relationship Id="rId{}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings" Target="sharedStrings.xml"/>'
+            '</Relationships>'.format(
+                "".join('<Relationship Id="rId{}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+                        'Target="worksheets/sheet{}.xml"/>'.format(sheet_no, sheet_no) for sheet_no in range(1, len(sheets) + 1)),
+                len(sheets) + 1))
+        for sheet_no, rows in enumerate(sheets.values(), 1):
+            xml_rows = "".join(xml_row(row_no, values) for row_no, values in enumerate(rows, 1) if values)
+            archive.writestr("xl/worksheets/sheet{}.xml".format(sheet_no),
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                '<sheetData>{}</sheetData></worksheet>'.format(xml_rows))
+        items = ['<si><t xml:space="preserve">{}</t></si>'.format(escape(value)) for value in strings[:-1]]
+        if strings:
+            items.append('<si><r><t>{}</t></r><r><t xml:space="preserve">{}</t></r></si>'.format(
+                escape(strings[-1][:2]), escape(strings[-1][2:])))
+        archive.writestr("xl/sharedStrings.xml",
+            '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">{}</sst>'.format("".join(items)))
+
+#------------------------------------------------------------------------------
+# The sheets (for WriteWorkbook) of a build workbook with num_devices devices
+# that uses every worksheet, site/group and device variables, nested
+# variables and templates, and has an error of every kind (including a loop
+# that only happens for one site), ignored rows and empty rows.
+# With sort_devices=False the rows of the device worksheets are shuffled.
+#------------------------------------------------------------------------------
+def GetBuildSheets(num_devices, sort_devices=True, seed=0):
+    rand = random.Random(seed)
+    devices = ["Switch-{:03d}".format(device_no) for device_no in range(num_devices)]
+    sites = ["SYD", "MEL", "BNE"]
+
+    templates = [["Enter config templates below this line:"], [],
+                 ["Config Template: [BASE]"], ["hostname [HOSTNAME]"], ["ntp server [NTP]"], ["logging host [SYSLOG]"],
+                 ["snmp-server location [SITE-NAME]"], ["[AAA]"],
+                 ["Config Template: [AAA]"], ["aaa new-model"], ["tacacs server [TACACS]"],
+                 ["Config Template: [LOOP-A]"], ["[LOOP-B]"], ["Config Template: [LOOP-B]"], ["  [LOOP-A]"],
+                 ["Config Template: [BANNER]"], ["banner motd ^[NO-SUCH-VARIABLE] [SITE-NAME]^"]]
+
+    variables = [["Variable", "Variable Value", "Comments", "Scope (leave blank if global)"],
+                 ["NTP", "10.0.0.1", "", ""], ["TACACS", "10.0.0.2", "", ""], ["SYSLOG", "[NTP]", "nested", ""],
+                 ["SITE-NAME", "unknown", "", ""], ["LOOP-1", "[LOOP-2]", "", ""], ["LOOP-2", "[LOOP-1]", "", ""],
+                 ["TACACS", "[TACACS-MEL]", "only loops for MEL", "MEL"], ["TACACS-MEL", "[TACACS]", "", "MEL"],
+                 ["TACACS", "9.9.9.9", "commented out", "!Switch-000"], ["EMPTY", "", "ignored", ""], []]
+    for site in sites:
+        variables.append(["SITE-NAME", "site-{}".format(site.lower()), "", site])
+    for device in devices[::2]:
+        variables.append(["HOSTNAME", device.lower(), "", device])
+
+    profiles = [["Device Name", "Template or Variable", "Position (Default: Start)", "Site/Group"]]
+    vlans = [["Device Name", "VLAN No", "VLAN Name"]]
+    portchannels = [["Device Name", "Interface", "Interface Enabled (yes/no)", "Port-Channel Group", "Port-Channel Mode (active/on/etc)",
+                     "Port-Channel Type (layer2 or layer3)", "Port-Channel Members (separated by commas)", "Description"]]
+    vrfs = [["Device Name", "VRF", "RD", "Import RT  (separated by commas)", "Export RT  (separated by commas)", "Variable"]]
+    interfaces = [["Device Name", "Interface", "Interface Enabled (yes/no)", "Speed", "Duplex", "MTU", "Description", "Variable 1",
+                   "Variable 2", "VRF (leave blank if global)", "IP Address (x.x.x.x/x)", "Data VLAN", "Voice VLAN", "Trunk Native VLAN",
+                   "Trunk Allowed VLANs (separated by commas)"]]
+    routes = [["Device Name", "VRF (leave blank if global)", "Route (x.x.x.x/x)", "Next Hop", "Route Name (no spaces)"]]
+    prefixes = [["Device Name", "Prefix-List Name", "Prefix-List Sequence No", "Prefix-List Action (permit/deny)", "Prefix-List Entry"]]
+    device_sheets = (profiles, vlans, portchannels, vrfs, interfaces, routes, prefixes)
+
+    for device_no, device in enumerate(devices):
+        site = sites[device_no % len(sites)]
+        subnet = "10.{}.{}".format(device_no // 256, device_no % 256)
+        profiles.append([device, "BASE", "Start", site])
+        profiles.append([device, "NTP", "End", ""])
+        if device_no % 4 == 1:
+            profiles.append([device, "BANNER", "Start/End", ""])
+        if device_no % 5 == 2:
+            profiles.append([device, "NO-SUCH-TEMPLATE", "", ""])
+        if device_no % 6 == 3:
+            profiles.append([device, "LOOP-A", "", ""])
+        for vlan, name in ((10, "DATA"), (20, "VOICE"), (999, "NATIVE")):
+            vlans.append([device, vlan, name])
+        if device_no % 7 == 4:
+            vlans.append([device, 30, ""])
+        interfaces.append([device, "Vlan10", "yes", "", "", "", "** Data **", "", "", "", subnet + ".1/24"])
+        interfaces.append([device, "Gi1/0/1", "yes", "1000", "full", "", "** Workstation **", "", "", "", "", 10, 20])
+        interfaces.append([device, "Gi1/0/2", "yes", "", "", 9216, "** Uplink **", "SYSLOG", "", "", "", "", "", 999, "10,20,999"])
+        interfaces.append([device, "Gi1/0/3", "no", "", "", "", "", "", "", "", "", 10])
+        if device_no % 3 == 0:
+            portchannels.append([device, "Po1", "yes", 1, "active", "layer2", "Gi1/0/47,Gi1/0/48", "** Port-Channel **"])
+            interfaces.append([device, "Po1", "yes", "", "", "", "", "", "", "", "", "", "", 999, "1-4094"])
+        if device_no % 4 == 0:
+            vrfs.append([device, "MGMT", "65000:{}".format(device_no), "65000:1,65000:2", "65000:1", "NTP"])
+            interfaces.append([device, "Gi1/0/4", "yes", "", "", "", "", "", "", "MGMT", subnet + ".129/25"])
+        # One of each interface error every few devices
+        error = device_no % 8
+        if error == 1:
+            interfaces.append([device, "Gi1/0/5", "yes", "", "", "", "", "NO-SUCH-VARIABLE", "LOOP-1", "", "", 40])
+        elif error == 2:
+            interfaces.append([device, "Gi1/0/5", "yes", "", "", "", "", "", "", "NO-SUCH-VRF", subnet + ".0/24"])
+        elif error == 3:
+            interfaces.append([device, "Gi1/0/5", "yes", "", "", "", "", "", "", "", "", "", 50, 60, "10,70-80"])
+        elif error == 4:
+            interfaces.append([device, "Gi1/0/5", "yes", "", "", "", "", "", "", "", subnet + ".9/24", 10])
+        elif error == 5:
+            interfaces.append([device, "Gi1/0/5", "yes", "", "", "", "", "", "", "", "", "", "", "", "1-4094000"])
+        routes.append([device, "", "0.0.0.0/0", subnet + ".254", "DEFAULT"])
+        if device_no % 4 == 0:
+            routes.append([device, "MGMT", "172.16.0.0/12", subnet + ".254", ""])
+        prefixes.append([device, "LOOPBACKS", 10, "permit", "10.255.0.0/16 le 32"])
+        prefixes.append([device, "LOOPBACKS", 5, "deny", "10.255.255.0/24"])
+
+    # Rows that are ignored or skipped, and a commented out device
+    interfaces.append([devices[0], "", "yes"])
+    vlans.append(["!Switch-OLD", 10, "DATA"])
+    routes.append([devices[-1], "", "192.168.0.0/16", "", ""])
+    for rows in device_sheets:
+        header = rows.pop(0)
+        if sort_devices:
+            rows.sort(key=lambda row: row[0].lstrip("!"))
+        else:
+            rand.shuffle(rows)
+        rows.insert(0, header)
+    interfaces.insert(2, [])
+
+    return {"Instructions": [[], ["", "Generated build workbook"]], "config-templates": templates, "variables": variables,
+            "profiles": profiles, "vlans": vlans, "portchannels": portchannels, "vrf": vrfs, "interfaces": interfaces,
+            "static routes": routes, "prefix-list": prefixes}
+
+#------------------------------------------------------------------------------
+# Run ccg-v2.2.py on workbook_file (with the options in args) in directory,
+# where it writes its files. RunCcgScript returns what it printed and RunCcg
+# returns {filename: contents} of every file in directory afterwards
+#------------------------------------------------------------------------------
+def RunCcgScript(workbook_file, directory, *args):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ccg-v2.2.py")
+    return subprocess.check_output([sys.executable, script, os.path.abspath(workbook_file)] + list(args), cwd=directory,
+                                   stderr=subprocess.STDOUT).decode()
+
+def RunCcg(workbook_file, directory, *args):
+    RunCcgScript(workbook_file, directory, *args)
+    files = {}
+    for filename in os.listdir(directory):
+        with open(os.path.join(directory, filename), "rb") as output_file:
+            files[filename] = output_file.read()
+    return files
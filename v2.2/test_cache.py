@@ -0,0 +1,47 @@
+import os
+import shutil
+import tempfile
+import unittest
+from ccg_support import LoadCcg, WriteWorkbook, GetBuildSheets, RunCcg
+
+__author__ = 'Abdul Karim El-Assaad'
+
+ccg = LoadCcg()
+
+#----------------------------------------------------------------------------
+# ccg-v2.2.py is loaded here with importlib (so it isn't in sys.modules) and
+# the CLI runs it as __main__, but both have to read each other's entries
+#----------------------------------------------------------------------------
+class BuildCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.directory, "cache")
+        self.workbook_file = os.path.join(self.directory, "build.xlsx")
+        WriteWorkbook(self.workbook_file, GetBuildSheets(12))
+        self.expected = ccg.GenerateConfigs(self.workbook_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def GetCache(self):
+        return ccg.BuildCache(self.cache_dir, 1 << 30)
+
+    def test_round_trip(self):
+        self.assertEqual(ccg.GenerateConfigs(self.workbook_file, cache=self.GetCache()), self.expected)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        cache = self.GetCache()
+        self.assertIsNotNone(cache.Load(cache.GetKey(self.workbook_file)))
+        self.assertEqual(ccg.GenerateConfigs(self.workbook_file, cache=self.GetCache()), self.expected)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+    def test_entry_written_by_script(self):
+        output_directory = os.path.join(self.directory, "output")
+        os.mkdir(output_directory)
+        RunCcg(self.workbook_file, output_directory, "--cache", self.cache_dir)
+        cache = self.GetCache()
+        self.assertIsNotNone(cache.Load(cache.GetKey(self.workbook_file)))
+        self.assertEqual(ccg.GenerateConfigs(self.workbook_file, cache=self.GetCache()), self.expected)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import random
+import unittest
+from ccg_support import LoadCcg
+
+__author__ = 'Abdul Karim El-Assaad'
+
+ccg = LoadCcg()
+
+#----------------------------------------------------------------------------
+# SortDependencies against a brute force reachability check: a name is looped
+# if it can reach itself, and everything else comes after what it references
+#----------------------------------------------------------------------------
+class SortDependenciesTest(unittest.TestCase):
+    def GetReachable(self, references, start):
+        found = set()
+        stack = [start]
+        while stack:
+            for child in references.get(stack.pop(), ()):
+                if child in references and child not in found:
+                    found.add(child)
+                    stack.append(child)
+        return found
+
+    def test_matches_brute_force(self):
+        rand = random.Random(3)
+        for test_no in range(2000):
+            names = ["N{}".format(name_no) for name_no in range(rand.randint(1, 12))]
+            references = {}
+            for name in names:
+                # Some references are to names that aren't in references (i.e. plain variables)
+                references[name] = [rand.choice(names + ["OTHER"]) for reference_no in range(rand.randint(0, 3))]
+            order, cycles, looped = ccg.SortDependencies(references)
+
+            self.assertEqual(sorted(order), sorted(names))
+            expected_looped = set(name for name in names if name in self.GetReachable(references, name))
+            self.assertEqual(looped, expected_looped, references)
+            position = dict((name, order.index(name)) for name in names)
+            for name in names:
+                if name in looped:
+                    continue
+                for child in references[name]:
+                    if child in references:
+                        self.assertLess(position[child], position[name], references)
+
+            # One loop per group of names that can all reach each other
+            components = set(frozenset(name for name in expected_looped
+                                       if name == start or (name in self.GetReachable(references, start) and start in self.GetReachable(references, name)))
+                             for start in expected_looped)
+            self.assertEqual(len(cycles), len(components), references)
+            for cycle in cycles:
+                self.assertEqual(cycle[0], cycle[-1])
+                for name, child in zip(cycle, cycle[1:]):
+                    self.assertIn(child, references[name])
+                    self.assertIn(name, looped)
+
+    def test_long_chain(self):
+        references = dict(("N{}".format(name_no), ["N{}".format(name_no + 1)]) for name_no in range(50000))
+        order, cycles, looped = ccg.SortDependencies(references)
+        self.assertEqual(order[0], "N49999")
+        self.assertEqual(cycles, [])
+
+if __name__ == '__main__':
+    unittest.main()
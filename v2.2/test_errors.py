@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+import unittest
+from ccg_support import LoadCcg, WriteWorkbook, GetBuildSheets, RunCcg
+
+__author__ = 'Abdul Karim El-Assaad'
+
+ccg = LoadCcg()
+
+class ErrorRecordTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.workbook_file = os.path.join(self.directory, "build.xlsx")
+        WriteWorkbook(self.workbook_file, GetBuildSheets(12))
+        self.build = ccg.GenerateConfigs(self.workbook_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    # ccg-errors.txt is the same records, formatted, under a banner for each worksheet
+    def test_records_match_error_report(self):
+        output_directory = os.path.join(self.directory, "output")
+        os.mkdir(output_directory)
+        report = RunCcg(self.workbook_file, output_directory)["ccg-errors.txt"].decode().splitlines()
+        expected_report = []
+        for entry in self.build["Errors"]:
+            if not expected_report or entry["Worksheet"] != worksheet:
+                worksheet = entry["Worksheet"]
+                expected_report.extend(["===========================", "Worksheet: [{}]".format(worksheet),
+                                        "==========================="])
+            expected_report.append(ccg.Config(None).FormatError(entry))
+        self.assertEqual(report, expected_report)
+        self.assertEqual(set(entry["Worksheet"] for entry in self.build["Errors"]), set(ccg.Config.ERROR_WORKSHEETS))
+
+    def test_record_fields(self):
+        errors = self.build["Errors"]
+        for entry in errors:
+            self.assertEqual(sorted(entry), ["Device", "Message", "Name", "Row", "Scope", "Worksheet"])
+        self.assertIn({"Worksheet": "interfaces", "Row": 19, "Device": "Switch-002", "Name": "Gi1/0/5",
+                       "Message": "referenced vrf 'NO-SUCH-VRF' which does not exist", "Scope": None}, errors)
+        self.assertIn({"Worksheet": "profiles", "Row": 9, "Device": "Switch-002", "Name": "NO-SUCH-TEMPLATE",
+                       "Message": "referenced variable 'NO-SUCH-TEMPLATE' which does not exist", "Scope": None}, errors)
+        self.assertIn({"Worksheet": "config-templates", "Row": None, "Device": None, "Name": "BANNER",
+                       "Message": "referenced embedded variable 'NO-SUCH-VARIABLE' which does not exist", "Scope": None}, errors)
+        scopes = [entry["Scope"] for entry in errors if entry["Worksheet"] == "variables" and entry["Name"] == "TACACS"]
+        self.assertEqual(scopes, [["MEL"], ["MEL", "Switch-004"], ["MEL", "Switch-010"]])
+
+if __name__ == '__main__':
+    unittest.main()
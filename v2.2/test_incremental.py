@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import unittest
+from ccg_support import WriteWorkbook, GetBuildSheets, RunCcg, RunCcgScript
+
+__author__ = 'Abdul Karim El-Assaad'
+
+#----------------------------------------------------------------------------
+# --incremental run end to end in one output directory. After every run the
+# files have to be the same as a normal run of that workbook writes
+#----------------------------------------------------------------------------
+class IncrementalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output_directory = os.path.join(self.directory, "output")
+        os.mkdir(self.output_directory)
+        self.workbook_file = self.WriteBuild("build.xlsx", GetBuildSheets(12))
+        self.expected = self.GetExpected(self.workbook_file)
+        self.assertEqual(self.RunIncremental(self.workbook_file), 12)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def WriteBuild(self, workbook_name, sheets):
+        workbook_file = os.path.join(self.directory, workbook_name)
+        WriteWorkbook(workbook_file, sheets)
+        return workbook_file
+
+    def GetExpected(self, workbook_file):
+        return RunCcg(workbook_file, tempfile.mkdtemp(dir=self.directory))
+
+    # Returns how many devices were generated and checks the files
+    def RunIncremental(self, workbook_file, expected=None):
+        output = RunCcgScript(workbook_file, self.output_directory, "--incremental")
+        files = {}
+        for filename in os.listdir(self.output_directory):
+            if filename != "ccg-manifest.json":
+                with open(os.path.join(self.output_directory, filename), "rb") as output_file:
+                    files[filename] = output_file.read()
+        self.assertEqual(files, expected or self.expected)
+        return output.count("configuration generated.")
+
+    def GetBuildSheets(self, tacacs):
+        sheets = GetBuildSheets(12)
+        for row in sheets["variables"]:
+            if row[:1] == ["TACACS"] and row[3] == "":
+                row[1] = tacacs
+        return sheets
+
+    def GetChangedFiles(self, files, other_files):
+        return [filename for filename in files if filename.startswith("Switch-") and files[filename] != other_files[filename]]
+
+    def test_unchanged(self):
+        self.assertEqual(self.RunIncremental(self.workbook_file), 0)
+
+    def test_changed(self):
+        sheets = GetBuildSheets(12)
+        for row in sheets["vlans"]:
+            if row[:2] == ["Switch-005", 20]:
+                row[2] = "PHONES"
+        workbook_file = self.WriteBuild("changed.xlsx", sheets)
+        self.assertEqual(self.RunIncremental(workbook_file, self.GetExpected(workbook_file)), 1)
+        self.assertEqual(self.RunIncremental(self.workbook_file), 1)
+
+    def test_missing_file(self):
+        os.remove(os.path.join(self.output_directory, "Switch-003.txt"))
+        self.assertEqual(self.RunIncremental(self.workbook_file), 1)
+
+    # A normal (or --stream) run of another workbook writes over some of the
+    # files without touching the manifest, and so does editing one by hand
+    def test_foreign_run(self):
+        workbook_file = self.WriteBuild("other.xlsx", self.GetBuildSheets("2.2.2.2"))
+        other_files = RunCcg(workbook_file, self.output_directory)
+        changed_files = self.GetChangedFiles(other_files, self.expected)
+        self.assertTrue(0 < len(changed_files) < 12)
+        self.assertEqual(self.RunIncremental(self.workbook_file), len(changed_files))
+        RunCcg(workbook_file, self.output_directory, "--stream")
+        self.assertEqual(self.RunIncremental(self.workbook_file), len(changed_files))
+        with open(os.path.join(self.output_directory, "Switch-000.txt"), "a") as output_file:
+            output_file.write("!\n")
+        self.assertEqual(self.RunIncremental(self.workbook_file), 1)
+
+if __name__ == '__main__':
+    unittest.main()
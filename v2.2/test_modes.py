@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import unittest
+from ccg_support import LoadCcg, WriteWorkbook, GetBuildSheets, RunCcg
+
+__author__ = 'Abdul Karim El-Assaad'
+
+ccg = LoadCcg()
+
+#----------------------------------------------------------------------------
+# Each mode of ccg-v2.2.py run end to end on a generated workbook, sorted by
+# device name and not, and the files it writes compared with a normal run's
+#----------------------------------------------------------------------------
+class OutputModesTest(unittest.TestCase):
+    WORKBOOKS = {"sorted.xlsx": GetBuildSheets(12), "unsorted.xlsx": GetBuildSheets(12, sort_devices=False, seed=1)}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.expected = {}
+        for workbook_name, sheets in cls.WORKBOOKS.items():
+            WriteWorkbook(os.path.join(cls.directory, workbook_name), sheets)
+            cls.expected[workbook_name] = cls.RunMode(workbook_name)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    # Each run gets a directory of its own
+    @classmethod
+    def RunMode(cls, workbook_name, *args):
+        return RunCcg(os.path.join(cls.directory, workbook_name), tempfile.mkdtemp(dir=cls.directory), *args)
+
+    def assertSameOutput(self, *args):
+        for workbook_name in self.WORKBOOKS:
+            self.assertEqual(self.RunMode(workbook_name, *args), self.expected[workbook_name], (workbook_name,) + args)
+
+    def test_jobs(self):
+        self.assertSameOutput("--jobs", "1")
+        self.assertSameOutput("--jobs", "3")
+
+    # The unsorted workbook falls back to reading the whole workbook
+    def test_stream(self):
+        self.assertSameOutput("--stream")
+        for workbook_name in self.WORKBOOKS:
+            workbook_file = os.path.join(self.directory, workbook_name)
+            configs = list(ccg.GenerateConfigs(workbook_file)["Configs"].items())
+            self.assertEqual(list(ccg.IterConfigs(workbook_file, stream=True)), configs)
+
+    def test_spill(self):
+        self.assertSameOutput("--spill", "5")
+        self.assertSameOutput("--spill", "1")
+
+    # The first run saves each workbook to the cache and the second loads it
+    def test_cache(self):
+        cache_dir = tempfile.mkdtemp(dir=self.directory)
+        self.assertSameOutput("--cache", cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), len(self.WORKBOOKS))
+        self.assertSameOutput("--cache", cache_dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import random
+import tempfile
+import unittest
+from ccg_support import LoadCcg, WriteWorkbook, EMPTY_STRING
+
+__author__ = 'Abdul Karim El-Assaad'
+
+ccg = LoadCcg()
+
+#-----------------------------------------------------------------------------
+# XlsxStreamReader against XlrdReader on a workbook with shared and inline
+# strings, rich text, numbers, booleans, gaps between cells and rows, and empty
+# rows at the end. Skipped if xlrd can't read .xlsx (2.x)
+#-----------------------------------------------------------------------------
+def RandomSheet(rand, num_columns):
+    values = ["Switch-1", "Gi1/0/1", "yes", "", "", "10.0.0.1/24", "a & b <c>", " padded ", 1.0, 2000.0, 4.5, True]
+    rows = [["Column {}".format(column) for column in range(num_columns)]]
+    for entry_no in range(rand.randint(0, 40)):
+        # Leave out a few rows now and then
+        rows.extend([[]] * rand.choice([0, 0, 0, 1, 4]))
+        rows.append([rand.choice(values) for column in range(rand.randint(1, num_columns))])
+    # Rows at the end that only have formatting or an empty string (only the
+    # empty strings are stored by xlrd)
+    for entry_no in range(rand.randint(0, 5)):
+        rows.append([rand.choice([None, None, EMPTY_STRING]) for column in range(rand.randint(1, num_columns))])
+    return rows
+
+class WorkbookReaderTest(unittest.TestCase):
+    def setUp(self):
+        if ccg.xlrd is None or not ccg.xlrd.__version__.startswith("1."):
+            self.skipTest("xlrd 1.x is needed to read .xlsx")
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def WriteRandomWorkbook(self, rand, test_no):
+        filename = os.path.join(self.temp_dir.name, "test-{}.xlsx".format(test_no))
+        sheets = {"interfaces": RandomSheet(rand, 6), "vlans": RandomSheet(rand, 3)}
+        WriteWorkbook(filename, sheets)
+        return filename, sheets
+
+    def test_readers_match(self):
+        rand = random.Random(6)
+        for test_no in range(40):
+            filename, sheets = self.WriteRandomWorkbook(rand, test_no)
+            stream_reader = ccg.XlsxStreamReader(filename)
+            xlrd_reader = ccg.XlrdReader(filename)
+            self.assertEqual(stream_reader.GetSheetNames(), xlrd_reader.GetSheetNames())
+            for sheet_name in sheets:
+                stream_rows = list(stream_reader.IterRows(sheet_name))
+                # xlrd pads every row out to the widest row
+                xlrd_rows = []
+                for row in xlrd_reader.IterRows(sheet_name):
+                    while row and row[-1] == "":
+                        row.pop()
+                    xlrd_rows.append(row)
+                self.assertEqual(stream_rows, xlrd_rows)
+                self.assertEqual(stream_reader.trimmed_rows[sheet_name], xlrd_reader.trimmed_rows[sheet_name])
+            stream_reader.Close()
+            xlrd_reader.Close()
+
+            # Same records and row counts once they've been through Config
+            stream_db = ccg.Config(ccg.XlsxStreamReader(filename))
+            xlrd_db = ccg.Config(ccg.XlrdReader(filename))
+            for sheet_name in sheets:
+                self.assertEqual([list(record.values) for record in stream_db.raw_db[sheet_name]],
+                                 [list(record.values) for record in xlrd_db.raw_db[sheet_name]])
+            self.assertEqual(stream_db.ingest_stats, xlrd_db.ingest_stats)
+            stream_db.workbook.Close()
+            xlrd_db.workbook.Close()
+
+    def test_trailing_rows_counted(self):
+        filename = os.path.join(self.temp_dir.name, "trailing.xlsx")
+        rows = [["Device Name", "Interface"], ["Switch-1", "Gi1/0/1"], [], ["", ""], ["Switch-1", "Gi1/0/2"],
+                [None, None], [EMPTY_STRING], [None], [EMPTY_STRING, None], [None]]
+        WriteWorkbook(filename, {"interfaces": rows})
+        for reader_class in (ccg.XlsxStreamReader, ccg.XlrdReader):
+            db = ccg.Config(reader_class(filename))
+            # Rows 3-4 are empty and rows 6-10 are dropped by the reader. Row 9
+            # is the last one with a stored cell, so row 10 isn't counted
+            self.assertEqual(db.ingest_stats["interfaces"], {"Rows": 2, "Empty Rows": 6, "Trimmed Rows": 4})
+            db.workbook.Close()
+
+if __name__ == '__main__':
+    unittest.main()
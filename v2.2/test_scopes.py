@@ -0,0 +1,84 @@
+import random
+import unittest
+from ccg_support import LoadCcg
+
+__author__ = 'Abdul Karim El-Assaad'
+
+ccg = LoadCcg()
+
+#--------------------------------------------------------------------------------
+# A device's scope (GetDeviceScope only expands what the scope changes) against
+# expanding every variable and config template again with the scope's values
+#--------------------------------------------------------------------------------
+class DeviceScopeTest(unittest.TestCase):
+    VARIABLES = ["V{}".format(name_no) for name_no in range(10)]
+    TEMPLATES = ["T{}".format(name_no) for name_no in range(6)]
+
+    def RandomValue(self, rand):
+        if rand.random() < 0.3:
+            return "x{}".format(rand.randint(0, 9))
+        if rand.random() < 0.1:
+            return ""
+        return " ".join("[{}]".format(rand.choice(self.VARIABLES + self.TEMPLATES)) if rand.random() < 0.5 else "w"
+                        for word_no in range(rand.randint(1, 3)))
+
+    def test_matches_full_expansion(self):
+        rand = random.Random(7)
+        variable_columns = {"Variable": 0, "Variable Value": 1, "Scope (leave blank if global)": 2, "Row": 3}
+        template_column = "Enter config templates below this line:"
+        template_columns = {template_column: 0, "Row": 1}
+        profile_columns = {"Device Name": 0, "Template or Variable": 1, "Site/Group": 2, "Row": 3}
+        for test_no in range(500):
+            variable_rows = []
+            for scope in ("", "SITE", "Switch-1"):
+                for name in rand.sample(self.VARIABLES, rand.randint(2 if scope else 5, 5 if scope else 10)):
+                    variable_rows.append(ccg.RowRecord(variable_columns, (name, self.RandomValue(rand), scope, len(variable_rows) + 2)))
+            template_rows = []
+            for template_name in self.TEMPLATES:
+                template_rows.append(ccg.RowRecord(template_columns, ("Config Template: [{}]".format(template_name), len(template_rows) + 2)))
+                for line_no in range(rand.randint(1, 4)):
+                    if rand.random() < 0.4:
+                        line = "  [{}]".format(rand.choice(self.VARIABLES + self.TEMPLATES))
+                    else:
+                        line = "line {}".format(self.RandomValue(rand))
+                    template_rows.append(ccg.RowRecord(template_columns, (line, len(template_rows) + 2)))
+            db = ccg.Config(None)
+            db.raw_db = {"variables": variable_rows, "config-templates": template_rows}
+            db.error_db = {"variables": [], "config-templates": [], "profiles": []}
+            db.device_db = {"Switch-1": {"profiles": [ccg.RowRecord(profile_columns, ("Switch-1", "T0", "SITE", 2))]}}
+            db.GetVariableList()
+            db.GetConfigTemplateList()
+            db.GetDeviceScope("Switch-1")
+
+            expected_db = ccg.Config(None)
+            expected_db.template_sources = db.template_sources
+            expected_db.template_rows = db.template_rows
+            values = dict(db.variable_values.get("", {}))
+            rows = dict(db.variable_rows.get("", {}))
+            for scope in ("SITE", "Switch-1"):
+                values.update(db.variable_values.get(scope, {}))
+                rows.update(db.variable_rows.get(scope, {}))
+            variables, looped = expected_db.ExpandVariables(values, rows, [])
+            config_templates, looped = expected_db.ExpandConfigTemplates(variables.get, [])
+            for variable_name in self.VARIABLES:
+                self.assertEqual(db.GetVariable(variable_name, "Switch-1"), variables.get(variable_name) or None)
+            for template_name in self.TEMPLATES:
+                self.assertEqual(db.GetConfigTemplate(template_name, "Switch-1"), config_templates.get(template_name) or None)
+
+    # A variable scoped to a commented out device mustn't become a global one
+    def test_commented_out_scope(self):
+        variable_columns = {"Variable": 0, "Variable Value": 1, "Scope (leave blank if global)": 2, "Row": 3}
+        rows = [("TAC", "9.9.9.9", "!Switch-B", 2), ("TAC", "1.1.1.1", "", 3),
+                ("LOG", "8.8.8.8", " ! SITE", 4), ("NTP", "2.2.2.2", "Switch-1", 5)]
+        db = ccg.Config(None)
+        db.raw_db = {"variables": [ccg.RowRecord(variable_columns, row) for row in rows], "config-templates": []}
+        db.error_db = {"variables": [], "config-templates": [], "profiles": []}
+        db.GetVariableList()
+        db.GetConfigTemplateList()
+        self.assertEqual(db.variable_list, {"TAC": "1.1.1.1"})
+        self.assertEqual(sorted(db.variable_values), ["", "Switch-1"])
+        self.assertEqual(db.GetVariable("TAC", "Switch-B"), "1.1.1.1")
+        self.assertEqual(db.GetVariable("LOG", "Switch-B"), None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import random
+import unittest
+from ccg_support import LoadCcg
+
+__author__ = 'Abdul Karim El-Assaad'
+
+ccg = LoadCcg()
+
+#-----------------------------------------------------------------------------
+# SortedRuns against sorted(), with small runs so there are plenty of merges
+#-----------------------------------------------------------------------------
+class SortedRunsTest(unittest.TestCase):
+    def test_matches_sorted(self):
+        rand = random.Random(5)
+        for num_entries, max_entries in ((0, 10), (5, 10), (10, 10), (1000, 1), (2000, 7), (5000, 3)):
+            keys = list(range(num_entries))
+            rand.shuffle(keys)
+            runs = ccg.SortedRuns(max_entries)
+            runs.MAX_RUNS = 4
+            peak_runs = 0
+            for key in keys:
+                runs.AddEntry(key, str(key))
+                peak_runs = max(peak_runs, len(runs.run_files))
+                # At most MAX_RUNS - 1 runs of each level are left open
+                if runs.run_levels:
+                    self.assertLess(len(runs.run_files), runs.MAX_RUNS * (max(runs.run_levels) + 1))
+            self.assertEqual(list(runs), [(key, str(key)) for key in sorted(keys)])
+            self.assertEqual(runs.run_files, [])
+            self.assertLess(peak_runs, 20)
+
+if __name__ == '__main__':
+    unittest.main()
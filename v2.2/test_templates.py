@@ -0,0 +1,112 @@
+import re
+import random
+import unittest
+from ccg_support import LoadCcg
+
+__author__ = 'Abdul Karim El-Assaad'
+
+ccg = LoadCcg()
+
+#----------------------------------------------------------------------------
+# The config template expansion from before ConfigTemplate: a regex and a
+# replace per variable, then the brackets stripped if any variable was found
+#----------------------------------------------------------------------------
+def OldExpandLine(line, get_value):
+    missing = []
+    valid_variable = False
+    for variable_name in re.findall(r'\[(.*?)\]', line):
+        lookup_variable = get_value(variable_name)
+        if lookup_variable:
+            valid_variable = True
+            line = line.replace(variable_name, lookup_variable)
+        else:
+            missing.append(variable_name)
+    if valid_variable:
+        line = line.replace("[", "").replace("]", "")
+    return line, missing
+
+class ConfigTemplateTest(unittest.TestCase):
+    # None of the names are part of another name or of the literal text, so the
+    # old replace() can't change anything other than the variable it's for
+    NAMES = ["HOSTNAME", "SITE-ID", "MGMT-VLAN", "DOMAIN", "MISSING-A", "MISSING-B"]
+    VALUES = {"HOSTNAME": "sw01", "SITE-ID": "syd", "MGMT-VLAN": "100", "DOMAIN": "example.com"}
+    LITERALS = ["interface ", " ", "vlan ", "-", "description ", "ip domain-name ", "[", "]", "x [", "] y", "  "]
+
+    # A stray "[" can make a slot such as "[HOSTNAME", which the old replace()
+    # of HOSTNAME rewrote as well (one of the bugs fixed), so those are skipped
+    def RandomLine(self, rand):
+        while True:
+            parts = []
+            for part_no in range(rand.randint(0, 6)):
+                if rand.random() < 0.4:
+                    parts.append("[{}]".format(rand.choice(self.NAMES)))
+                else:
+                    parts.append(rand.choice(self.LITERALS))
+            line = "".join(parts) or "!"
+            if all(slot in self.NAMES or not any(name in slot for name in self.NAMES)
+                   for slot in re.findall(r'\[(.*?)\]', line)):
+                return line
+
+    def test_render_matches_old_expansion(self):
+        rand = random.Random(1)
+        for test_no in range(3000):
+            lines = [self.RandomLine(rand) for line_no in range(rand.randint(1, 8))]
+            rendered, missing = ccg.ConfigTemplate(lines).Render(self.VALUES.get)
+            expected_lines = []
+            expected_missing = []
+            for line in lines:
+                expected_line, line_missing = OldExpandLine(line, self.VALUES.get)
+                expected_lines.append(expected_line)
+                expected_missing.extend(line_missing)
+            self.assertEqual(rendered, expected_lines, lines)
+            self.assertEqual(missing, expected_missing, lines)
+
+    # Goes through GetConfigTemplateList so the lines shared between templates
+    # come from the split/rendered line caches
+    def test_template_list_matches_old_expansion(self):
+        rand = random.Random(2)
+        column = "Enter config templates below this line:"
+        columns = {column: 0, "Row": 1}
+        for test_no in range(200):
+            shared_lines = [self.RandomLine(rand) for line_no in range(5)]
+            templates = {}
+            rows = []
+            for template_no in range(rand.randint(1, 6)):
+                template_name = "TEMPLATE-{}".format(template_no)
+                rows.append(ccg.RowRecord(columns, ("Config Template: [{}]".format(template_name), len(rows) + 2)))
+                templates[template_name] = []
+                for line_no in range(rand.randint(1, 10)):
+                    line = rand.choice(shared_lines) if rand.random() < 0.7 else self.RandomLine(rand)
+                    templates[template_name].append(line)
+                    rows.append(ccg.RowRecord(columns, (line, len(rows) + 2)))
+            db = ccg.Config(None)
+            db.raw_db["config-templates"] = rows
+            db.error_db["config-templates"] = []
+            db.variable_list = dict(self.VALUES)
+            db.GetConfigTemplateList()
+
+            expected_errors = []
+            for template_name, lines in templates.items():
+                expected_lines = []
+                for line in lines:
+                    expected_line, line_missing = OldExpandLine(line, self.VALUES.get)
+                    expected_lines.append(expected_line)
+                    expected_errors.extend("Config-Template: '{}' referenced embedded variable '{}' which does not exist".format(template_name, name)
+                                           for name in line_missing)
+                self.assertEqual(db.GetConfigTemplate(template_name), expected_lines)
+            self.assertEqual([db.FormatError(entry) for entry in db.error_db["config-templates"]], expected_errors)
+
+    def test_include_is_indented(self):
+        db = ccg.Config(None)
+        column = "Enter config templates below this line:"
+        columns = {column: 0, "Row": 1}
+        lines = ["Config Template: [AAA]", "aaa new-model", "Config Template: [BASE]", "hostname [HOSTNAME]", "  [AAA]"]
+        db.raw_db["config-templates"] = [ccg.RowRecord(columns, (line, row_no)) for row_no, line in enumerate(lines, 2)]
+        db.error_db["config-templates"] = []
+        db.variable_list = dict(self.VALUES)
+        db.GetConfigTemplateList()
+        self.assertEqual(db.GetConfigTemplate("BASE"), ["hostname sw01", "  aaa new-model"])
+        self.assertEqual(db.error_db["config-templates"], [])
+
+if __name__ == '__main__':
+    unittest.main()
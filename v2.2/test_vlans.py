@@ -0,0 +1,71 @@
+import random
+import unittest
+from ccg_support import LoadCcg
+
+__author__ = 'Abdul Karim El-Assaad'
+
+ccg = LoadCcg()
+
+#-----------------------------------------------------------
+# VlanRanges against the same VLANs held in a plain set
+#-----------------------------------------------------------
+class VlanRangesTest(unittest.TestCase):
+    def GetVlans(self, vlan_ranges):
+        vlans = set()
+        for start, end in vlan_ranges:
+            vlans.update(range(start, end + 1))
+        return vlans
+
+    def test_matches_set(self):
+        rand = random.Random(4)
+        for test_no in range(3000):
+            entries = []
+            for entry_no in range(rand.randint(0, 6)):
+                start = rand.randint(1, 60)
+                entries.append((start, start + rand.choice([0, 0, 1, 2, 10])))
+            expected = set()
+            for start, end in entries:
+                expected.update(range(start, end + 1))
+            vlan_ranges = ccg.VlanRanges(entries)
+
+            self.assertEqual(self.GetVlans(vlan_ranges), expected)
+            for (start, end), (next_start, next_end) in zip(vlan_ranges, list(vlan_ranges)[1:]):
+                self.assertLess(end + 1, next_start)
+            self.assertEqual(ccg.VlanRanges.FromString(str(vlan_ranges)).ranges, vlan_ranges.ranges)
+
+    def test_from_string(self):
+        self.assertEqual(str(ccg.VlanRanges.FromString("20, 1-10,21,5-12, 30-31")), "1-12,20,21,30,31")
+        self.assertEqual(ccg.VlanRanges.FromString("").ranges, [])
+        for text in ("10-1", "1-2-3", "a", "1,,x"):
+            self.assertRaises(ValueError, ccg.VlanRanges.FromString, text)
+
+#----------------------------------------------------------------
+# VlanBitmap against the VLANs on the device held in a plain set
+#----------------------------------------------------------------
+class VlanBitmapTest(unittest.TestCase):
+    def test_matches_set(self):
+        rand = random.Random(8)
+        for test_no in range(3000):
+            entries = []
+            for entry_no in range(rand.randint(0, 6)):
+                start = rand.randint(1, 60)
+                entries.append((start, start + rand.choice([0, 0, 1, 2, 10])))
+            trunk_vlans = set()
+            for start, end in entries:
+                trunk_vlans.update(range(start, end + 1))
+            device_vlans = set(rand.sample(range(1, 70), rand.randint(0, 69)))
+            bitmap = ccg.VlanBitmap(device_vlans)
+            self.assertEqual(bitmap.Covers(ccg.VlanRanges(entries)), trunk_vlans <= device_vlans)
+            for vlan in range(0, 75):
+                self.assertEqual(vlan in bitmap, vlan in device_vlans)
+
+    def test_out_of_range(self):
+        bitmap = ccg.VlanBitmap(range(1, 4095))
+        self.assertTrue(bitmap.Covers(ccg.VlanRanges.FromString("1-4094")))
+        self.assertFalse(bitmap.Covers(ccg.VlanRanges.FromString("1-4096")))
+        self.assertFalse(bitmap.Covers(ccg.VlanRanges.FromString("1-4094000000000")))
+        self.assertFalse(-1 in bitmap)
+        self.assertFalse(5000 in bitmap)
+
+if __name__ == '__main__':
+    unittest.main()